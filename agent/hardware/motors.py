@@ -1,4 +1,7 @@
 import time
+from math import sin, cos
+from collections import deque
+from itertools import islice
 from .simple_device import Motor, eprint
 
 class Picker(Motor):
@@ -171,4 +174,47 @@ class DriveBase:
         """Stop the robot"""
         # Stop robot by stopping motors
         self.leftmotor.stop()
-        self.rightmotor.stop()
\ No newline at end of file
+        self.rightmotor.stop()
+
+
+class Odometry:
+    """Remember the wheel positions of a DriveBase for a while, to tell how far it moved since a moment in the past"""
+
+    def __init__(self, base, history=1):
+        self.base = base
+        self.history = history
+        self.samples = deque()
+
+    def sample(self):
+        """Read the wheel positions now. Call this at least once every loop."""
+        now = time.time()
+        self.samples.append((now, self.base.leftmotor.position, self.base.rightmotor.position))
+        # Keep one sample from before the history, to interpolate from
+        while len(self.samples) > 2 and self.samples[1][0] < now - self.history:
+            self.samples.popleft()
+
+    def wheels_at(self, t):
+        """Left and right wheel positions (deg) at time t, interpolated between the samples"""
+        samples = self.samples
+        if t <= samples[0][0]:
+            return samples[0][1:]
+        for (t0, left0, right0), (t1, left1, right1) in zip(samples, islice(samples, 1, None)):
+            if t <= t1:
+                f = (t - t0) / (t1 - t0)
+                return left0 + f*(left1 - left0), right0 + f*(right1 - right0)
+        return samples[-1][1:]
+
+    def motion_since(self, t):
+        """Displacement [x, y] (cm) and counterclockwise turn (rad) of the base from time t to the last sample
+
+        The displacement is in the robot frame at time t, with y pointing forward.
+        """
+        left0, right0 = self.wheels_at(t)
+        now, left1, right1 = self.samples[-1]
+        left = (left1 - left0) * self.base.wheel_cm_sec_per_deg_s
+        right = (right1 - right0) * self.base.wheel_cm_sec_per_deg_s
+        distance = (left + right) / 2
+        turn = (right - left) / self.base.wheel_span
+
+        # Along an arc, the displacement is in the direction halfway the turn
+        return [-distance*sin(turn/2), distance*cos(turn/2)], turn
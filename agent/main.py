@@ -3,11 +3,13 @@
 from lightvectors.lightvectors import vector
 import time
 import logging
-from hardware.motors import DriveBase, Picker
+from hardware.motors import DriveBase, Picker, Odometry
 from hardware.simple_device import PowerSupply, Buttons
 from springs import Spring
 from ball_sensor_reader import BallSensorReader
-import socket, pickle, gzip, sys
+from packets.codec import decode_packet, SETTINGS, WORLD_FRAME
+from packets.worldview import robot_view, move_view
+import socket, sys
 import random
 
 #################################################################
@@ -19,13 +21,31 @@ try:
 except:
     MY_ID = 3
 
+# Listen to the world frame the server sends to all robots at once, instead of a frame made
+# for this robot only. This must match BROADCAST_MODE in the server settings.
+WORLD_MODE = False
+WORLD_ADDRESS = '239.255.0.1'
+WORLD_PORT = 50100
+
+# Bring the positions from the server up to date with how far we drove since the camera saw them,
+# using the wheel encoders. The packets tell how old they were when they were sent,
+# to which we add a guess of the time on the network (s).
+LATENCY_COMPENSATION = True
+NETWORK_DELAY = 0.005
+
 # Log settings
 logging.basicConfig(format='%(asctime)s, %(levelname)s, %(message)s',datefmt='%H:%M:%S', level=logging.INFO)
 
 # Start data thread
 s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-port = 50000+MY_ID
-s.bind(('', 50000+MY_ID))
+if WORLD_MODE:
+    port = WORLD_PORT
+    s.bind(('', port))
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                 socket.inet_aton(WORLD_ADDRESS) + socket.inet_aton('0.0.0.0'))
+else:
+    port = 50000+MY_ID
+    s.bind(('', 50000+MY_ID))
 s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1500)
 s.settimeout(0.1)
 logging.debug("Listening on port {0}".format(port))
@@ -38,6 +58,7 @@ base = DriveBase(left=('outC', DriveBase.POLARITY_INVERSED),
                  wheel_diameter=4.3,
                  wheel_span=12,
                  counter_clockwise_is_positive=False) 
+odometry = Odometry(base)
 picker = Picker('outA')
 battery = PowerSupply()
 buttons = Buttons()
@@ -69,6 +90,13 @@ failcount = 0
 last_volt_check = time.time()
 no_force = vector([0, 0])
 
+# Robot settings are sent separately, and only when they change
+robot_settings = None
+settings_version = None
+
+# Settings version of which the state was taken over. Settings are sent again now and then, without changes.
+state_settings_version = None
+
 
 def empty_udp_buffer(socket):
     try:
@@ -116,12 +144,53 @@ while True:
 
     try:
         # Get robot positions and settings from server
-        compressed_data, server = s.recvfrom(1500)
-        data = pickle.loads(gzip.decompress(compressed_data))
+        packet, server = s.recvfrom(1500)
+        odometry.sample()
+        kind, sequence, data = decode_packet(packet)
+
+        if kind == SETTINGS:
+            settings_version, robot_settings = data
+
+            # Unpack some useful data from the settings we received
+            my_gripper = vector(robot_settings['p_bot_gripper'])
+            my_center = vector([0,0])
+            my_tail = -my_gripper
+
+            # Unpack spring characteristics
+            robot_avoidance_spring = Spring(robot_settings['robot_avoidance_spring'])
+            robot_avoidance_spring_inferior = Spring(robot_settings['robot_avoidance_spring_inferior'])
+            robot_attraction_spring = Spring(robot_settings['robot_attraction_spring'])
+            spring_to_walls = Spring(robot_settings['spring_to_walls'])
+            spring_to_balls = Spring(robot_settings['spring_to_balls'])
+            spring_to_line = Spring(robot_settings['spring_to_line'])
+            spring_to_position = Spring(robot_settings['spring_to_position'])
+            spring_to_depot = Spring(robot_settings['spring_to_depot'])
+
+            # A state set on the server applies once, when the settings change
+            if settings_version != state_settings_version:
+                state_settings_version = settings_version
+                if robot_settings.get('state'):
+                    state = robot_settings['state']
+            logging.debug("Got settings version {0}".format(settings_version))
+
+            # Now wait for the positions
+            continue
+
+        if robot_settings is None:
+            logging.debug("Waiting for robot settings...")
+            continue
+
+        if kind == WORLD_FRAME:
+            # Compute my own view of the world. Automatic exception if MY_ID is not in it.
+            data = robot_view(data, MY_ID, robot_settings)
+
+        if LATENCY_COMPENSATION:
+            capture_time = time.time() - data['age'] - NETWORK_DELAY
+            displacement, turn = odometry.motion_since(capture_time)
+            data = move_view(data, displacement, turn, robot_settings)
 
         # Get the data. Automatic exception if no data is available for MY_ID
         neighbor_info = data['neighbors']
-        robot_settings = data['robot_settings']
         wall_info = data['walls']
         ball_info = data['balls']
         depot_info = data['depots']
@@ -129,25 +198,9 @@ while True:
 
         # Unpack some useful data from the information we received
         neighbors = neighbor_info.keys()
-        my_gripper = vector(robot_settings['p_bot_gripper'])
-        my_center = vector([0,0])
-        my_tail = -my_gripper
 
         # Check how many balls are near me
         number_of_balls = len(ball_info)
-        
-        # Unpack spring characteristics
-        robot_avoidance_spring = Spring(robot_settings['robot_avoidance_spring'])
-        robot_avoidance_spring_inferior = Spring(robot_settings['robot_avoidance_spring_inferior'])
-        robot_attraction_spring = Spring(robot_settings['robot_attraction_spring'])
-        spring_to_walls = Spring(robot_settings['spring_to_walls'])
-        spring_to_balls = Spring(robot_settings['spring_to_balls'])
-        spring_to_line = Spring(robot_settings['spring_to_line'])
-        spring_to_position = Spring(robot_settings['spring_to_position'])
-        spring_to_depot = Spring(robot_settings['spring_to_depot'])
-        if 'state' in robot_settings:
-            if robot_settings['state']:
-                state = robot_settings['state']
 
     except Exception as e:
         # Stop the loop if we're unable to get server data
@@ -246,12 +299,13 @@ while True:
     nett_depot_avoidance = robot_avoidance_spring.get_force_vector(nearest_depot_to_my_gripper)
 
     # 4.5 Line following forces for line mode
-    force_to_line_endpoint = 0
-    force_to_line = 0
+    force_to_line_endpoint = no_force
+    force_to_line = no_force
 
     if len(line_info) > 0:
-        force_to_position = spring_to_line_endpoint.get_force_vector(line_info['endpoint'])
-        force_to_line = spring_to_line.get_force_vector(line_info['closest_point'])
+        # Both are in my frame, pull my gripper towards them
+        force_to_line_endpoint = spring_to_position.get_force_vector(vector(line_info['endpoint']) - my_gripper)
+        force_to_line = spring_to_line.get_force_vector(vector(line_info['closest_point']) - my_gripper)
 
     # 5. Start with a zero total force for processing all state behaviour
     total_force = no_force
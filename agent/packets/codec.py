@@ -0,0 +1,282 @@
+"""Binary packets between the position server and the agents
+
+Shared by the server and the agents, so it uses nothing but the standard library.
+
+Each packet starts with a header: version, packet kind, and a sequence number.
+Robot frames carry the geometry of one camera frame, as seen by one robot.
+World frames carry the geometry of one camera frame in the world frame, for
+all robots at once. Each agent then computes its own view (see worldview.py).
+Robot settings (spring tables etc.) rarely change, so they are sent in a
+separate settings packet, only when they change and once in a while for agents
+that just started. Each robot frame says which settings version it belongs to.
+
+Frames carry the time the camera frame was taken, on the server clock, and how old
+it was when the packet was sent. The velocity of the robots comes with their pose.
+
+All coordinates are little-endian 32 bit floats, in cm, velocities in cm/s and rad/s.
+"""
+
+import struct
+import json
+import time
+
+VERSION = 2
+
+# Packet kinds
+ROBOT_FRAME = 1
+SETTINGS = 2
+WORLD_FRAME = 3
+
+# Version, kind, sequence number
+HEADER = struct.Struct('<BBH')
+
+# Settings version, number of neighbors, balls and depots, flags
+ROBOT_FRAME_HEADER = struct.Struct('<HBBBB')
+
+# Capture time of the camera frame (s, server clock), and its age when sent (s)
+TIMING = struct.Struct('<df')
+
+# Velocity (x, y), angular velocity, and seconds since the robot was last seen.
+# In a robot frame, the velocity of that robot in its own frame.
+MOTION = struct.Struct('<4f')
+
+# Wall distances (top, bottom, left, right), world_x, world_y, and corners A, B, C and D
+WALLS = struct.Struct('<16f')
+
+# Robot id, visibility, gripper location, center location
+NEIGHBOR = struct.Struct('<BB4f')
+
+# A single 2D point
+POINT = struct.Struct('<2f')
+
+# Line endpoint and closest point on the line
+LINE = struct.Struct('<4f')
+
+# Settings version
+SETTINGS_HEADER = struct.Struct('<H')
+
+# Settings version, number of robots, balls and depots, flags
+WORLD_FRAME_HEADER = struct.Struct('<HBHBB')
+
+# Field corners A, B, C and D
+CORNERS = struct.Struct('<8f')
+
+# Robot id, position and heading of the robot base in the world, and its motion like MOTION
+ROBOT_POSE = struct.Struct('<B7f')
+
+# Largest UDP payload that fits in one ethernet frame
+MAX_PACKET_SIZE = 1472
+
+# Flags
+HAS_LINE = 1
+
+
+class PacketError(ValueError):
+    """Raised when a packet can't be decoded"""
+    pass
+
+
+def pack_timing(capture_time):
+    """Capture time and age of a frame, as it is sent now"""
+    return TIMING.pack(capture_time, time.time() - capture_time if capture_time else 0.0)
+
+
+def encode_robot_frame(data, settings_version, sequence=0):
+    """Pack the data for one robot, as made by make_data_for_robots, into bytes"""
+    neighbors = data['neighbors']
+    balls = data['balls']
+    depots = data['depots']
+    walls = data['walls']
+    line = data.get('line')
+
+    flags = HAS_LINE if line else 0
+
+    parts = [HEADER.pack(VERSION, ROBOT_FRAME, sequence & 0xFFFF),
+             ROBOT_FRAME_HEADER.pack(settings_version & 0xFFFF, len(neighbors), len(balls), len(depots), flags),
+             pack_timing(data['time']),
+             MOTION.pack(*data['motion']['velocity'], data['motion']['angular_velocity'], data['motion']['coasting']),
+             WALLS.pack(*walls['distances'],
+                        *walls['world_x'],
+                        *walls['world_y'],
+                        *[value for corner in walls['corners'] for value in corner])]
+
+    for neighbor_id, neighbor in neighbors.items():
+        parts.append(NEIGHBOR.pack(neighbor_id,
+                                   neighbor['is_visible'],
+                                   *neighbor['gripper_location'],
+                                   *neighbor['center_location']))
+
+    for ball in balls:
+        parts.append(POINT.pack(*ball))
+
+    for depot in depots:
+        parts.append(POINT.pack(*depot))
+
+    if line:
+        parts.append(LINE.pack(*line['endpoint'], *line['closest_point']))
+
+    return b''.join(parts)
+
+
+def encode_settings(robot_settings, settings_version, sequence=0):
+    """Pack the robot settings into bytes"""
+    return HEADER.pack(VERSION, SETTINGS, sequence & 0xFFFF) + \
+        SETTINGS_HEADER.pack(settings_version & 0xFFFF) + \
+        json.dumps(robot_settings, separators=(',', ':')).encode()
+
+
+def encode_world_frame(world, settings_version, sequence=0):
+    """Pack the world frame, as made by make_world_frame, into bytes
+
+    If there are too many balls to fit in one packet, the remaining balls are left out.
+    """
+    robots = world['robots']
+    depots = world['depots']
+    line = world.get('line')
+
+    flags = HAS_LINE if line else 0
+
+    # Number of balls that still fit in the packet
+    size = HEADER.size + WORLD_FRAME_HEADER.size + TIMING.size + CORNERS.size + \
+        ROBOT_POSE.size * len(robots) + POINT.size * len(depots) + (LINE.size if line else 0)
+    balls = world['balls'][:max(0, (MAX_PACKET_SIZE - size) // POINT.size)]
+
+    parts = [HEADER.pack(VERSION, WORLD_FRAME, sequence & 0xFFFF),
+             WORLD_FRAME_HEADER.pack(settings_version & 0xFFFF, len(robots), len(balls), len(depots), flags),
+             pack_timing(world['time']),
+             CORNERS.pack(*[value for corner in world['corners'] for value in corner])]
+
+    for robot_id, (x, y, heading) in robots.items():
+        parts.append(ROBOT_POSE.pack(robot_id, x, y, heading, *world['motion'][robot_id]))
+
+    for ball in balls:
+        parts.append(POINT.pack(*ball))
+
+    for depot in depots:
+        parts.append(POINT.pack(*depot))
+
+    if line:
+        parts.append(LINE.pack(*line[0], *line[1]))
+
+    return b''.join(parts)
+
+
+def decode_robot_frame(packet, offset=HEADER.size):
+    """Unpack a robot frame into the same dictionary structure as the server made"""
+    settings_version, n_neighbors, n_balls, n_depots, flags = ROBOT_FRAME_HEADER.unpack_from(packet, offset)
+    offset += ROBOT_FRAME_HEADER.size
+
+    capture_time, age = TIMING.unpack_from(packet, offset)
+    offset += TIMING.size
+
+    vx, vy, angular_velocity, coasting = MOTION.unpack_from(packet, offset)
+    offset += MOTION.size
+
+    walls = WALLS.unpack_from(packet, offset)
+    offset += WALLS.size
+
+    neighbors = {}
+    for i in range(n_neighbors):
+        neighbor_id, visible, gx, gy, cx, cy = NEIGHBOR.unpack_from(packet, offset)
+        offset += NEIGHBOR.size
+        neighbors[neighbor_id] = {'gripper_location': [gx, gy],
+                                  'center_location': [cx, cy],
+                                  'is_visible': bool(visible)}
+
+    balls = []
+    for i in range(n_balls):
+        balls.append(list(POINT.unpack_from(packet, offset)))
+        offset += POINT.size
+
+    depots = []
+    for i in range(n_depots):
+        depots.append(list(POINT.unpack_from(packet, offset)))
+        offset += POINT.size
+
+    line = {}
+    if flags & HAS_LINE:
+        ex, ey, px, py = LINE.unpack_from(packet, offset)
+        line = {'endpoint': [ex, ey], 'closest_point': [px, py]}
+
+    return {'settings_version': settings_version,
+            'time': capture_time,
+            'age': age,
+            'motion': {'velocity': [vx, vy],
+                       'angular_velocity': angular_velocity,
+                       'coasting': coasting},
+            'neighbors': neighbors,
+            'balls': balls,
+            'depots': depots,
+            'walls': {'distances': walls[0:4],
+                      'world_x': list(walls[4:6]),
+                      'world_y': list(walls[6:8]),
+                      'corners': [list(walls[8:10]), list(walls[10:12]), list(walls[12:14]), list(walls[14:16])]},
+            'line': line}
+
+
+def decode_world_frame(packet, offset=HEADER.size):
+    """Unpack a world frame into the same dictionary structure as the server made"""
+    settings_version, n_robots, n_balls, n_depots, flags = WORLD_FRAME_HEADER.unpack_from(packet, offset)
+    offset += WORLD_FRAME_HEADER.size
+
+    capture_time, age = TIMING.unpack_from(packet, offset)
+    offset += TIMING.size
+
+    corners = CORNERS.unpack_from(packet, offset)
+    offset += CORNERS.size
+
+    robots = {}
+    motion = {}
+    for i in range(n_robots):
+        robot_id, x, y, heading, vx, vy, angular_velocity, coasting = ROBOT_POSE.unpack_from(packet, offset)
+        offset += ROBOT_POSE.size
+        robots[robot_id] = [x, y, heading]
+        motion[robot_id] = [vx, vy, angular_velocity, coasting]
+
+    balls = []
+    for i in range(n_balls):
+        balls.append(list(POINT.unpack_from(packet, offset)))
+        offset += POINT.size
+
+    depots = []
+    for i in range(n_depots):
+        depots.append(list(POINT.unpack_from(packet, offset)))
+        offset += POINT.size
+
+    line = []
+    if flags & HAS_LINE:
+        x1, y1, x2, y2 = LINE.unpack_from(packet, offset)
+        line = [[x1, y1], [x2, y2]]
+
+    return {'settings_version': settings_version,
+            'time': capture_time,
+            'age': age,
+            'robots': robots,
+            'motion': motion,
+            'balls': balls,
+            'depots': depots,
+            'corners': [list(corners[0:2]), list(corners[2:4]), list(corners[4:6]), list(corners[6:8])],
+            'line': line}
+
+
+def decode_settings(packet, offset=HEADER.size):
+    """Unpack a settings packet into the settings version and the robot settings dictionary"""
+    settings_version, = SETTINGS_HEADER.unpack_from(packet, offset)
+    return settings_version, json.loads(packet[offset + SETTINGS_HEADER.size:].decode())
+
+
+def decode_packet(packet):
+    """Return the packet kind, sequence number and decoded contents of a packet"""
+    try:
+        version, kind, sequence = HEADER.unpack_from(packet)
+        if version != VERSION:
+            raise PacketError("Packet version {0}, expected {1}".format(version, VERSION))
+        if kind == ROBOT_FRAME:
+            return kind, sequence, decode_robot_frame(packet)
+        if kind == SETTINGS:
+            return kind, sequence, decode_settings(packet)
+        if kind == WORLD_FRAME:
+            return kind, sequence, decode_world_frame(packet)
+    except struct.error as exc:
+        raise PacketError("Truncated packet: {0}".format(exc))
+    raise PacketError("Unknown packet kind {0}".format(kind))
@@ -0,0 +1,200 @@
+"""Compute the view of one robot from a world frame
+
+This does the same as make_data_for_robots on the position server, but only
+for one robot, and without numpy so it runs on the agent.
+"""
+
+from heapq import nsmallest
+from math import sin, cos, sqrt
+
+
+class Pose:
+    """Position (cm) and heading (rad) of a robot base in the world frame"""
+
+    def __init__(self, x, y, heading):
+        self.x, self.y = x, y
+        self.c, self.s = cos(heading), sin(heading)
+
+    def to_world(self, point):
+        """Transform a point in the robot frame into the world frame"""
+        px, py = point
+        return [self.c*px - self.s*py + self.x, self.s*px + self.c*py + self.y]
+
+    def to_robot(self, point):
+        """Transform a point in the world frame into the robot frame"""
+        dx, dy = point[0] - self.x, point[1] - self.y
+        return [self.c*dx + self.s*dy, -self.s*dx + self.c*dy]
+
+
+def norm(vector):
+    return sqrt(vector[0]*vector[0] + vector[1]*vector[1])
+
+
+def get_neighbor_info(my_id, robots, robot_settings):
+    """Gripper and center location of all other robots, from my point of view"""
+    me = robots[my_id]
+    my_gripper = robot_settings['p_bot_gripper']
+    neighbor_info = {}
+    for neighbor, pose in robots.items():
+        if neighbor == my_id:
+            continue
+        # Gripper location of other robot, in my reference frame
+        gripper = me.to_robot(pose.to_world(my_gripper))
+        neighbor_info[neighbor] = {'gripper_location': gripper,
+                                   'center_location': me.to_robot((pose.x, pose.y)),
+                                   'is_visible': norm(gripper) < robot_settings['sight_range']}
+    return neighbor_info
+
+
+def get_ball_info(me, balls, robot_settings, max_balls):
+    """Nearest balls relative to my gripper, sorted by distance. Only those are transformed into my frame."""
+    gx, gy = robot_settings['p_bot_gripper']
+    gx_world, gy_world = me.to_world((gx, gy))
+    nearest = nsmallest(max_balls, balls, key=lambda ball: (ball[0] - gx_world)**2 + (ball[1] - gy_world)**2)
+    balls_relative_to_gripper = []
+    for ball in nearest:
+        x, y = me.to_robot(ball)
+        balls_relative_to_gripper.append([x - gx, y - gy])
+    return balls_relative_to_gripper
+
+
+def get_wall_info(me, corners_world, robot_settings):
+    """Distances to the walls and the world axes, from my point of view. See get_wall_info on the server."""
+    corners_agent = [me.to_robot(corner) for corner in corners_world]
+    A_agent, B_agent, C_agent, D_agent = corners_agent
+    A_world, B_world, C_world, D_world = corners_world
+
+    # Location of my gripper and rear in the world frame
+    my_gripper_world = me.to_world(robot_settings['p_bot_gripper'])
+    my_rear_world = me.to_world(robot_settings['p_bot_rear'])
+
+    # X and Y index
+    X, Y = 0, 1
+
+    # Check if gripper or rear is closer to the walls
+    closest_to_top = max(my_gripper_world[Y], my_rear_world[Y])
+    closest_to_bottom = min(my_gripper_world[Y], my_rear_world[Y])
+    closest_to_left = min(my_gripper_world[X], my_rear_world[X])
+    closest_to_right = max(my_gripper_world[X], my_rear_world[X])
+
+    # Distances
+    distance_to_top = (A_world[Y]+B_world[Y])/2 - closest_to_top
+    distance_to_bottom = closest_to_bottom - (C_world[Y]+D_world[Y])/2
+    distance_to_left = closest_to_left - (A_world[X]+D_world[X])/2
+    distance_to_right = (B_world[X]+C_world[X])/2 - closest_to_right
+
+    micron = 0.001
+    distances = (max(distance_to_top, micron), max(distance_to_bottom, micron),
+                 max(distance_to_left, micron), max(distance_to_right, micron))
+
+    # Lines e and f in agent frames, as unit vectors
+    world_x = [B_agent[X] - A_agent[X], B_agent[Y] - A_agent[Y]]
+    world_y = [B_agent[X] - C_agent[X], B_agent[Y] - C_agent[Y]]
+    length_x, length_y = norm(world_x), norm(world_y)
+
+    return {'distances': distances,
+            'world_x': [world_x[X]/length_x, world_x[Y]/length_x],
+            'world_y': [world_y[X]/length_y, world_y[Y]/length_y],
+            'corners': corners_agent}
+
+
+def get_line_info(me, line, robot_settings):
+    """Line endpoint and the point on the line closest to my gripper, from my point of view"""
+    if not line:
+        return {}
+    (x1, y1), (x2, y2) = line
+    gx, gy = me.to_world(robot_settings['p_bot_gripper'])
+
+    # Project the gripper onto the line
+    dx, dy = x2 - x1, y2 - y1
+    t = ((gx - x1)*dx + (gy - y1)*dy) / (dx*dx + dy*dy)
+    return {'endpoint': me.to_robot((x2, y2)),
+            'closest_point': me.to_robot((x1 + t*dx, y1 + t*dy))}
+
+
+def robot_view(world, robot_id, robot_settings, max_balls=3):
+    """Turn a decoded world frame into the same dictionary a robot frame decodes into.
+
+    Raises KeyError if robot_id is not in the world frame.
+    """
+    robots = {i: Pose(*pose) for i, pose in world['robots'].items()}
+    me = robots[robot_id]
+
+    # My velocity in my own frame of reference
+    vx, vy, angular_velocity, coasting = world['motion'][robot_id]
+    velocity = me.to_robot((me.x + vx, me.y + vy))
+
+    return {'settings_version': world['settings_version'],
+            'time': world['time'],
+            'age': world['age'],
+            'motion': {'velocity': velocity,
+                       'angular_velocity': angular_velocity,
+                       'coasting': coasting},
+            'neighbors': get_neighbor_info(robot_id, robots, robot_settings),
+            'balls': get_ball_info(me, world['balls'], robot_settings, max_balls),
+            'depots': [me.to_robot(depot) for depot in world['depots']],
+            'walls': get_wall_info(me, world['corners'], robot_settings),
+            'line': get_line_info(me, world['line'], robot_settings)}
+
+
+def move_view(view, displacement, turn, robot_settings):
+    """The view of a robot after it moved by displacement [x, y] (cm) and turned counterclockwise by turn (rad)
+
+    The displacement is in the robot frame of the view. Use this to bring a view up to date with odometry,
+    when it was captured a while ago. Everything else is taken to stand still.
+    """
+    now = Pose(displacement[0], displacement[1], turn)
+    gx, gy = robot_settings['p_bot_gripper']
+
+    def rotate(vector):
+        return now.to_robot((now.x + vector[0], now.y + vector[1]))
+
+    neighbors = {}
+    for neighbor, info in view['neighbors'].items():
+        gripper = now.to_robot(info['gripper_location'])
+        neighbors[neighbor] = {'gripper_location': gripper,
+                               'center_location': now.to_robot(info['center_location']),
+                               'is_visible': norm(gripper) < robot_settings['sight_range']}
+
+    # Balls keep their order: the server puts the ball this robot goes for first, not the nearest one
+    balls = []
+    for x, y in view['balls']:
+        x, y = now.to_robot((x + gx, y + gy))
+        balls.append([x - gx, y - gy])
+
+    # Distances to the walls are from whichever of my gripper and rear is closest, along the world axes
+    walls = view['walls']
+    world_x, world_y = walls['world_x'], walls['world_y']
+    ends_before = [robot_settings['p_bot_gripper'], robot_settings['p_bot_rear']]
+    ends_after = [now.to_world(end) for end in ends_before]
+    xs_before = [x*world_x[0] + y*world_x[1] for x, y in ends_before]
+    ys_before = [x*world_y[0] + y*world_y[1] for x, y in ends_before]
+    xs_after = [x*world_x[0] + y*world_x[1] for x, y in ends_after]
+    ys_after = [x*world_y[0] + y*world_y[1] for x, y in ends_after]
+    top, bottom, left, right = walls['distances']
+    micron = 0.001
+    distances = (max(top + max(ys_before) - max(ys_after), micron),
+                 max(bottom - min(ys_before) + min(ys_after), micron),
+                 max(left - min(xs_before) + min(xs_after), micron),
+                 max(right + max(xs_before) - max(xs_after), micron))
+
+    line = view['line']
+    if line:
+        (x1, y1), (x2, y2) = now.to_robot(line['closest_point']), now.to_robot(line['endpoint'])
+        # Project the gripper onto the line again
+        dx, dy = x2 - x1, y2 - y1
+        t = ((gx - x1)*dx + (gy - y1)*dy) / (dx*dx + dy*dy) if dx or dy else 0
+        line = {'endpoint': [x2, y2],
+                'closest_point': [x1 + t*dx, y1 + t*dy]}
+
+    moved = dict(view)
+    moved.update({'neighbors': neighbors,
+                  'balls': balls,
+                  'depots': [now.to_robot(depot) for depot in view['depots']],
+                  'walls': {'distances': distances,
+                            'world_x': rotate(world_x),
+                            'world_y': rotate(world_y),
+                            'corners': [now.to_robot(corner) for corner in walls['corners']]},
+                  'line': line})
+    moved['motion'] = dict(view['motion'], velocity=rotate(view['motion']['velocity']))
+    return moved
@@ -1,4 +1,5 @@
-import logging, socket, time, gzip, pickle
+import logging, socket, time
+from packets.codec import decode_packet, SETTINGS
 
 MY_ID = 3
 
@@ -53,12 +54,16 @@ while True:
 
     try:
         # Get robot positions and settings from server
-        compressed_data, server = s.recvfrom(1500)
-        data = pickle.loads(gzip.decompress(compressed_data))
+        packet, server = s.recvfrom(1500)
+        kind, sequence, data = decode_packet(packet)
+
+        if kind == SETTINGS:
+            settings_version, robot_settings = data
+            print(robot_settings)
+            continue
 
         # Get the data. Automatic exception if no data is available for MY_ID
         neighbor_info = data['neighbors']
-        robot_settings = data['robot_settings']
         wall_info = data['walls']
         ball_info = data['balls']
 
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from functools import lru_cache
 from operator import itemgetter
 from linalg import unit_vector
 
@@ -16,14 +17,26 @@ def pixel(img_grey, vector):
         return 0
 
 
-def adjust_curve(image, factor=2.5):
+@lru_cache(maxsize=16)
+def curve_table(factor):
     # build a lookup table mapping the pixel values [0, 255] to
     # their steepened curve values
-    table = np.array([min(255, i*factor)
-                      for i in np.arange(0, 256)]).astype("uint8")
+    table = np.minimum(np.arange(256) * factor, 255).astype("uint8")
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=16)
+def curve_threshold_table(factor, threshold):
+    """Lookup table that steepens the curve and then thresholds, in one go"""
+    table = np.where(curve_table(factor) > threshold, 255, 0).astype("uint8")
+    table.flags.writeable = False
+    return table
+
 
+def adjust_curve(image, factor=2.5):
     # apply gamma correction using the lookup table
-    return cv2.LUT(image, table)
+    return cv2.LUT(image, curve_table(factor))
 
 
 def find_largest_n_side(img, sides=4):
@@ -111,29 +124,68 @@ def rect_from_image_size(width, height):
         [0, height]], dtype="float32")
 
 
-def find_nested_triangles(img, threshold=150, threshold_type="simple", depth=2):
-    triangles = []
-    img_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+def threshold_image(img, threshold=150, threshold_type="simple", factor=1.4, dst=None, grey_buffer=None):
+    """Convert a BGR or greyscale image into a black and white image for contour finding
+
+    The result is written into dst, and the greyscale version of a BGR image into grey_buffer, if given.
+    See Thresholder to reuse them for every frame.
+    """
+    if img.ndim == 3:
+        img_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=grey_buffer)
+    else:
+        img_grey = img
 
     if threshold_type == "simple":
-        # convert to grayscale and adjust gamma curve
-        img_grey = adjust_curve(img_grey, factor=1.4)
-        # Simple adaptive mean thresholding
-        values, img_grey = cv2.threshold(img_grey, threshold, 255, cv2.THRESH_BINARY)
+        # Adjust gamma curve and threshold, with a single lookup table
+        img_bw = cv2.LUT(img_grey, curve_threshold_table(factor, threshold), dst=dst)
 
     elif threshold_type == "otsu":
-        values, img_grey = cv2.threshold(img_grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        values, img_bw = cv2.threshold(img_grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
 
     elif threshold_type == "adaptive":
-        img_grey = cv2.adaptiveThreshold(img_grey, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 17, 2)
+        img_bw = cv2.adaptiveThreshold(img_grey, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 17, 2,
+                                       dst=dst)
 
     elif threshold_type == "canny":
-        img_grey = cv2.Canny(img_grey, 50, 150)
-        img_grey = cv2.dilate(img_grey, np.ones((2, 2)))
+        img_bw = cv2.Canny(img_grey, 50, 150, edges=dst)
+        img_bw = cv2.dilate(img_bw, np.ones((2, 2)), dst=img_bw)
         # img_grey = cv2.dilate(img_grey, np.array([[0,1,0],[1,1,1],[0,1,0]], dtype=np.uint8))
 
+    else:
+        raise ValueError("Unknown threshold type {0}".format(threshold_type))
+
+    return img_bw
+
+
+class Thresholder:
+    """threshold_image for a stream of frames, reusing the greyscale buffer for every frame
+
+    The black and white result is passed on to the next stage, so it gets a new buffer,
+    unless one is given.
+    """
+
+    def __init__(self):
+        self.grey_buffer = None
+
+    def threshold(self, img, threshold=150, threshold_type="simple", factor=1.4, dst=None):
+        if img.ndim == 3 and (self.grey_buffer is None or self.grey_buffer.shape != img.shape[:2]):
+            self.grey_buffer = np.empty(img.shape[:2], dtype=np.uint8)
+        return threshold_image(img, threshold, threshold_type, factor, dst, self.grey_buffer)
+
+
+def find_triangles_in_binary(img_grey, depth=2, offset=(0, 0)):
+    """Find triangular contours that have nested children in a black and white image
+
+    The offset is added to all contour points, to search a region of a larger image.
+    """
+    triangles = []
+
     # Find contours and tree
-    img_grey, contours, hierarchy = cv2.findContours(img_grey, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    img_grey, contours, hierarchy = cv2.findContours(img_grey, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                     offset=offset)
+    if hierarchy is None:
+        # Nothing in this image
+        return img_grey, triangles
 
     # Find triangular contours with at least 2 children. These must be our markers!
     for x in range(0, len(contours)):
@@ -160,6 +212,124 @@ def find_nested_triangles(img, threshold=150, threshold_type="simple", depth=2):
     return img_grey, triangles
 
 
+def regions_overlap(a, b):
+    """True if two rectangles (x0, y0, x1, y1) overlap"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_regions(regions):
+    """Merge overlapping rectangles (x0, y0, x1, y1), so nothing is found twice"""
+    merged = []
+    for region in regions:
+        # Grow the region with all merged regions it overlaps. Those never overlap each other.
+        i = 0
+        while i < len(merged):
+            if regions_overlap(merged[i], region):
+                other = merged.pop(i)
+                region = (min(region[0], other[0]), min(region[1], other[1]),
+                          max(region[2], other[2]), max(region[3], other[3]))
+                i = 0
+            else:
+                i += 1
+        merged.append(region)
+    return merged
+
+
+def downscale_binary(img_grey, scale):
+    """Shrink a black and white image by an integer factor, keeping it black and white"""
+    height, width = img_grey.shape[:2]
+    img_small = cv2.resize(img_grey, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+    values, img_small = cv2.threshold(img_small, 127, 255, cv2.THRESH_BINARY)
+    return img_small
+
+
+def contour_regions(contours, scale, margin, image_shape):
+    """Rectangles (x0, y0, x1, y1) in the full size image around contours found in a downscaled image
+
+    Contours that are closer than twice the margin share a rectangle.
+    """
+    height, width = image_shape[:2]
+    small_margin = -(-margin // scale)
+
+    # Draw the contours with a thick outline in a mask, and take the bounding box of each blob in it.
+    # That merges nearby contours without a python loop over all pairs.
+    mask = np.zeros((height // scale, width // scale), dtype=np.uint8)
+    cv2.drawContours(mask, contours, -1, 255, cv2.FILLED)
+    cv2.drawContours(mask, contours, -1, 255, 2 * small_margin + 1)
+    mask, blobs, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for blob in blobs:
+        x, y, w, h = cv2.boundingRect(blob)
+        regions.append((x * scale, y * scale, min((x + w) * scale, width), min((y + h) * scale, height)))
+    return regions
+
+
+def contour_points(contours):
+    """All points of a list of contours in one (N, 2) array, and where each contour starts in it"""
+    lengths = np.fromiter(map(len, contours), dtype=int, count=len(contours))
+    return np.concatenate(contours).reshape((-1, 2)), np.cumsum(lengths) - lengths
+
+
+def contour_boxes(points, starts):
+    """Lowest and highest x and y of each contour in contour_points, as two (K, 2) arrays"""
+    return np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts)
+
+
+def enclosing_circles(points, starts, min_radius, max_radius, candidates=None):
+    """Enclosing circles with a radius in range, of the contours in contour_points
+
+    Only the contours of which the bounding box allows such a circle are looked at one by one:
+    the radius is at least half the longest side of the box, and at most half its diagonal.
+    Candidates can rule out more contours, with False.
+    Returns the indices of the contours with a circle in range, its centre (K, 2) and radius (K,).
+    """
+    lows, highs = contour_boxes(points, starts)
+    sides = (highs - lows).astype(float)
+    # A pixel to spare, for rounding in minEnclosingCircle
+    possible = (sides.max(axis=1) < 2 * max_radius + 1) & (np.hypot(sides[:, 0], sides[:, 1]) > 2 * min_radius - 1)
+    if candidates is not None:
+        possible &= candidates
+
+    ends = np.append(starts[1:], len(points))
+    indices, centres, radii = [], [], []
+    for i in np.flatnonzero(possible).tolist():
+        c, r = cv2.minEnclosingCircle(points[starts[i]:ends[i]])
+        if min_radius < r < max_radius:
+            indices.append(i)
+            centres.append(c)
+            radii.append(r)
+    return np.array(indices, dtype=int), np.array(centres).reshape((-1, 2)), np.array(radii)
+
+
+def find_triangles_in_regions(img_grey, regions, depth=2):
+    """Find nested triangles only in some rectangles (x0, y0, x1, y1) of a black and white image"""
+    triangles = []
+    for x0, y0, x1, y1 in regions:
+        # Copy the region, findContours may change its input
+        region_grey, region_triangles = find_triangles_in_binary(img_grey[y0:y1, x0:x1].copy(), depth,
+                                                                 offset=(x0, y0))
+        triangles += region_triangles
+    return triangles
+
+
+def find_triangles_pyramid(img_grey, scale=1, depth=2):
+    """Find nested triangles in a downscaled black and white image, then find them exactly in the full image
+
+    With a scale of 1, this is the same as find_triangles_in_binary.
+    """
+    if scale <= 1:
+        return find_triangles_in_binary(img_grey, depth)
+    img_small, candidates = find_triangles_in_binary(downscale_binary(img_grey, scale), depth)
+    regions = contour_regions(candidates, scale, 2 * scale, img_grey.shape)
+    return img_grey, find_triangles_in_regions(img_grey, regions, depth)
+
+
+def find_nested_triangles(img, threshold=150, threshold_type="simple", depth=2):
+    img_grey = threshold_image(img, threshold, threshold_type)
+    return find_triangles_in_binary(img_grey, depth)
+
+
 def find_largest_rectangle_transform(img, offset, look_for='edges'):
 
         height, width = np.shape(img)[:2]
@@ -215,6 +385,48 @@ def find_largest_rectangle_transform(img, offset, look_for='edges'):
         return img, M, dst, width, height
 
 
+class PerspectiveWarp:
+    """Does the same as cv2.warpPerspective with a fixed matrix, but with lookup tables made only once
+
+    warpPerspective computes the source location of every pixel for every frame.
+    Here they are computed when the playing field is accepted, and stored in fixed point.
+    """
+
+    def __init__(self, M, width, height):
+        self.M = M
+        self.M_inverse = np.linalg.inv(M)
+        self.size = (width, height)
+        self.shape = (height, width)
+
+        # Greyscale camera image, reused for every frame by warp_grey
+        self.grey_buffer = None
+
+        # Location in the camera image of each pixel in the warped image
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        destination = np.dstack((xs, ys))
+        source = cv2.perspectiveTransform(destination.reshape(-1, 1, 2), self.M_inverse).reshape(height, width, 2)
+        self.map1, self.map2 = cv2.convertMaps(source, None, cv2.CV_16SC2)
+
+    def warp(self, img, dst=None):
+        """Warp a camera image, colour or greyscale, to the playing field. Writes into dst if given."""
+        return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst)
+
+    def warp_grey(self, img, dst=None):
+        """Warp only the greyscale version of a colour camera image, that's a third of the work"""
+        self.grey_buffer = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.grey_buffer)
+        return self.warp(self.grey_buffer, dst)
+
+    def to_field(self, points):
+        """Map points (N x 2) in the camera image to the same points in the warped image"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.M).reshape(-1, 2)
+
+    def to_camera(self, points):
+        """Map points (N x 2) in the warped image to the same points in the camera image"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.M_inverse).reshape(-1, 2)
+
+
 def find_blobs(img, min_hsv, max_hsv, min_size):
     img_HSV = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     img_blobs = cv2.inRange(img_HSV, min_hsv, max_hsv)
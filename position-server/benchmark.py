@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Replays recorded camera frames through the image analysis of the position server, without a window,
+# and reports the time of each stage, frames per second and what was detected.
+# Use it to check that a change to the vision code makes it faster and still finds the same things.
+#
+# Usage:
+#   python3 benchmark.py test_images                      Replay all images in a directory, or a single image
+#   python3 benchmark.py recording.avi --json new.json    Replay a video and save the results
+#   python3 benchmark.py test_images --compare old.json   Compare with an earlier run. Exits with 1 on a regression.
+#
+# The server asks to confirm the playing field. Without a human to ask, the whole image is used,
+# unless --field edges or --field 4_blobs is given. Then the field is detected once, in the first frame.
+# Images are taken to be unrelated snapshots, so each is analysed from scratch. Only the frames of a video
+# are tracked from one to the next, like the server does.
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+from antoncv import find_largest_rectangle_transform, offset_convex_polygon, rect_from_image_size, \
+    Thresholder, PerspectiveWarp
+from detection import find_robot_markers, find_balls
+from tracking import MarkerTracker, IdVoting, PoseFilter, BallTracker
+from pipeline import BufferPool
+from robot_frames import FieldCalibration
+from parse_camera_data import make_data_for_robots, bounding_boxes, GeometryCache
+from settings import server_settings, robot_settings
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Stages in the order the server runs them
+STAGES = ('warp', 'threshold', 'triangles', 'markers', 'balls', 'robot_data')
+
+
+def read_frames(source, max_frames=None):
+    """Yield the frames of a video file, or of all images in a directory"""
+    if os.path.isdir(source):
+        files = sorted(f for f in glob.glob(os.path.join(source, '**', '*'), recursive=True)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+        frames = (cv2.imread(f) for f in files)
+    elif source.lower().endswith(IMAGE_EXTENSIONS):
+        frames = [cv2.imread(source)]
+    else:
+        cap = cv2.VideoCapture(source)
+        frames = iter(lambda: cap.read()[1], None)
+
+    for n, img in enumerate(frames):
+        if max_frames is not None and n >= max_frames:
+            break
+        if img is not None:
+            yield img
+
+
+class Replay:
+    """The image analysis of the position server, for one playing field, with a timer around each stage"""
+
+    def __init__(self, img, field='none'):
+        start = time.perf_counter()
+        if field == 'none':
+            self.found_playing_field = False
+            self.field_warp = None
+            self.field_corners = rect_from_image_size(server_settings['WIDTH'], server_settings['HEIGHT'])
+        else:
+            # Like the server, when the user accepts the field the first time
+            img, M, dst, width, height = find_largest_rectangle_transform(
+                np.array(img), server_settings['extra border outside'], look_for=field)
+            self.field_warp = PerspectiveWarp(M, width, height)
+            self.found_playing_field = True
+            self.field_corners = offset_convex_polygon(dst, -server_settings['extra border outside'] +
+                                                       server_settings['extra border inside'])
+        self.calibration = FieldCalibration(server_settings, self.field_corners)
+        self.field_time = time.perf_counter() - start
+
+        self.thresholder = Thresholder()
+        self.buffers = BufferPool()
+        self.reset_tracking()
+        self.timings = {stage: [] for stage in STAGES}
+        self.frames = []
+
+    def reset_tracking(self):
+        """Forget the robots and balls of earlier frames, for a frame that does not follow them"""
+        self.marker_tracker = MarkerTracker(server_settings['FULL_SCAN_INTERVAL'],
+                                            server_settings['MARKER_SEARCH_MARGIN'],
+                                            server_settings['MARKER_DETECTION_SCALE'])
+        self.id_voting = IdVoting(server_settings['ID_VOTE_FRAMES'], server_settings['MARKER_SEARCH_MARGIN'])
+        self.pose_filter = PoseFilter(server_settings['POSE_FILTER_GAIN'], server_settings['MAX_COAST_TIME'])
+        self.ball_tracker = BallTracker(server_settings['MAX_BALL_RADIUS_PX'] * 2, server_settings['BALL_MEMORY_TIME'])
+        self.geometry_cache = GeometryCache(server_settings['GEOMETRY_MOVE_THRESHOLD'])
+
+    def timed(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def warp(self, frame, img_cam):
+        """Warp the camera image into a buffer of the frame, like the warp stage of the server"""
+        if not self.found_playing_field or server_settings['DETECT_UNWARPED']:
+            return img_cam
+        if server_settings['WARP_GREY']:
+            return self.field_warp.warp_grey(img_cam, dst=self.buffers.take(frame, self.field_warp.shape))
+        return self.field_warp.warp(img_cam, dst=self.buffers.take(frame, self.field_warp.shape + (3,)))
+
+    def robot_data(self, robot_markers, balls, t):
+        """Filtered poses and the data for each robot, like the packets stage of the server"""
+        markers, motion = self.pose_filter.update(robot_markers, t)
+        boxes = []
+        if markers:
+            midbases, apexes = zip(*markers.values())
+            boxes = bounding_boxes(server_settings, midbases, apexes, self.calibration)
+        balls, ball_ids = self.ball_tracker.update(balls, t, boxes)
+        markers = {robot_id: marker for robot_id, marker in markers.items() if robot_id >= 0}
+        return make_data_for_robots(markers, balls, self.calibration, server_settings, robot_settings,
+                                    [(-200, -200), (200, 200)], motion, t, ball_ids, self.ball_tracker.targets,
+                                    self.geometry_cache)
+
+    def analyse(self, img_cam, t):
+        """Run one frame through all stages, and remember what was found"""
+        # Like the server, see detection_warp there
+        detection_warp = self.field_warp if server_settings['DETECT_UNWARPED'] else None
+
+        frame = {}
+        img = self.timed('warp', self.warp, frame, img_cam)
+        img_grey = self.timed('threshold', self.thresholder.threshold, img, server_settings['THRESHOLD'],
+                              server_settings['THRESHOLD_TYPE'], server_settings['THRESHOLD_CURVE'],
+                              self.buffers.take(frame, img.shape[:2]))
+        img_grey, triangles = self.timed('triangles', self.marker_tracker.find_triangles, img_grey, t)
+        robot_markers = self.timed('markers', find_robot_markers,
+                                   img_grey, triangles, server_settings, self.calibration, detection_warp,
+                                   self.id_voting)
+        self.marker_tracker.update(robot_markers, t, detection_warp)
+        balls = self.timed('balls', find_balls,
+                           img_grey, server_settings, self.calibration, self.found_playing_field,
+                           server_settings['BALL_DETECTION_SCALE'], detection_warp)
+        self.timed('robot_data', self.robot_data, robot_markers, balls, t)
+        self.frames.append({'robots': sorted(robot_markers), 'balls': len(balls)})
+        self.buffers.release_frame(frame)
+
+
+def percentiles(samples):
+    """Mean, 95th and 99th percentile of a list of durations, in ms"""
+    samples = np.array(samples) * 1000
+    return {'mean': float(samples.mean()),
+            'p95': float(np.percentile(samples, 95)),
+            'p99': float(np.percentile(samples, 99))}
+
+
+def replay(source, field='none', max_frames=None, frame_rate=30):
+    """Replay all frames of a source, and return the results as a dictionary"""
+    still_images = os.path.isdir(source) or source.lower().endswith(IMAGE_EXTENSIONS)
+    analysis = None
+    for n, img in enumerate(read_frames(source, max_frames)):
+        if analysis is None:
+            analysis = Replay(img, field)
+        elif still_images:
+            analysis.reset_tracking()
+        # Frames are taken to be recorded at a fixed frame rate, for the marker tracker
+        analysis.analyse(img, n / frame_rate)
+
+    if analysis is None:
+        raise SystemExit("No frames in {0}".format(source))
+
+    total = np.sum([analysis.timings[stage] for stage in STAGES], axis=0)
+    robots = [len(frame['robots']) for frame in analysis.frames]
+    balls = [frame['balls'] for frame in analysis.frames]
+    return {'source': source,
+            'field': field,
+            'frames': len(analysis.frames),
+            'field_detection_ms': analysis.field_time * 1000,
+            'fps': len(total) / float(total.sum()),
+            'stages': dict({stage: percentiles(analysis.timings[stage]) for stage in STAGES},
+                           total=percentiles(total)),
+            'robots_per_frame': float(np.mean(robots)),
+            'balls_per_frame': float(np.mean(balls)),
+            'buffers_allocated': analysis.buffers.allocated,
+            'detections': analysis.frames}
+
+
+def report(result):
+    print("{0}: {1} frames, field {2}, {3:.1f} fps".format(result['source'], result['frames'],
+                                                          result['field'], result['fps']))
+    print("{0:<12}{1:>10}{2:>10}{3:>10}".format("Stage (ms)", "mean", "p95", "p99"))
+    for stage, stats in result['stages'].items():
+        print("{0:<12}{1:>10.2f}{2:>10.2f}{3:>10.2f}".format(stage, stats['mean'], stats['p95'], stats['p99']))
+    print("Field detection: {0:.1f} ms. Per frame: {1:.2f} robots, {2:.2f} balls".format(
+        result['field_detection_ms'], result['robots_per_frame'], result['balls_per_frame']))
+    if 'buffers_allocated' in result:
+        print("Image buffers allocated: {0}".format(result['buffers_allocated']))
+
+
+def compare(old, new, tolerance=0.1):
+    """Print the differences between two runs. Returns False if the new run is slower or detects other things."""
+    ok = True
+    print("{0:<12}{1:>10}{2:>10}{3:>10}".format("Mean (ms)", "old", "new", "change"))
+    for stage in new['stages']:
+        if stage not in old['stages']:
+            continue
+        old_ms, new_ms = old['stages'][stage]['mean'], new['stages'][stage]['mean']
+        print("{0:<12}{1:>10.2f}{2:>10.2f}{3:>+9.0f}%".format(stage, old_ms, new_ms, (new_ms / old_ms - 1) * 100))
+    print("{0:<12}{1:>10.1f}{2:>10.1f}{3:>+9.0f}%".format("fps", old['fps'], new['fps'],
+                                                          (new['fps'] / old['fps'] - 1) * 100))
+    if new['fps'] < old['fps'] * (1 - tolerance):
+        print("Regression: more than {0:.0f}% slower".format(tolerance * 100))
+        ok = False
+
+    # Compare what was found in each frame
+    changed = [n for n, (a, b) in enumerate(zip(old['detections'], new['detections'])) if a != b]
+    if len(old['detections']) != len(new['detections']):
+        print("Regression: {0} frames before, {1} now".format(len(old['detections']), len(new['detections'])))
+        ok = False
+    elif changed:
+        print("Regression: other robots or number of balls in {0} frames, first in frame {1}: {2} -> {3}".format(
+            len(changed), changed[0], old['detections'][changed[0]], new['detections'][changed[0]]))
+        ok = False
+    else:
+        print("Same detections in all {0} frames".format(len(new['detections'])))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the position server vision")
+    parser.add_argument('source', help="directory with images, or a video file")
+    parser.add_argument('--field', choices=('none', 'edges', '4_blobs'), default='none',
+                        help="how to find the playing field in the first frame (default: use the whole image)")
+    parser.add_argument('--frames', type=int, default=None, help="replay at most this many frames")
+    parser.add_argument('--repeat', type=int, default=1, help="replay the source this many times")
+    parser.add_argument('--json', help="save the results to this file")
+    parser.add_argument('--compare', help="compare with the results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fraction the frame rate may drop before it counts as a regression")
+    args = parser.parse_args()
+
+    result = replay(args.source, args.field, args.frames)
+    for i in range(args.repeat - 1):
+        # Keep the fastest run, the others were disturbed by something else on this computer
+        again = replay(args.source, args.field, args.frames)
+        if again['fps'] > result['fps']:
+            result = again
+    report(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(json.load(f), result, args.tolerance):
+                sys.exit(1)
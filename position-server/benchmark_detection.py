@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Compares marker and ball detection on downscaled images (MARKER_DETECTION_SCALE and BALL_DETECTION_SCALE)
+# with detection at full size, on the saved test images. Full size detection is the reference for the accuracy.
+# With --specks, that many black specks are added to each image first, like lighting noise.
+# Usage: python3 benchmark_detection.py [--specks number] [image files]
+
+import sys
+import glob
+import timeit
+import cv2
+import numpy as np
+
+from antoncv import threshold_image, find_triangles_pyramid, rect_from_image_size
+from detection import find_robot_markers, find_balls
+from robot_frames import FieldCalibration
+from settings import server_settings
+
+SCALES = (1, 2, 4)
+
+
+def detect_markers(img_grey, scale, calibration):
+    """Markers in a camera image, as found by the position server without playing field"""
+    img_grey, triangles = find_triangles_pyramid(img_grey, scale)
+    return find_robot_markers(img_grey, triangles, server_settings, calibration)
+
+
+def detect_balls(img_grey, scale, calibration):
+    """Balls in a camera image, after the robots were blacked out by detect_markers"""
+    return find_balls(img_grey, server_settings, calibration, False, scale)
+
+
+def add_specks(img_grey, number, seed=0):
+    """Black out random pixels, with their neighbours"""
+    height, width = img_grey.shape[:2]
+    for x, y in np.random.default_rng(seed).integers(0, (width, height), (number, 2)).tolist():
+        cv2.circle(img_grey, (x, y), 1, 0, cv2.FILLED)
+
+
+def time_ms(function):
+    return min(timeit.repeat(function, number=10, repeat=3)) / 10 * 1000
+
+
+def match(reference, found, max_distance=3):
+    """Number of reference points with a found point nearby, and their mean distance in pixels"""
+    if not len(reference) or not len(found):
+        return 0, 0
+    distances = np.linalg.norm(np.array(reference, dtype=float)[:, None] - np.array(found, dtype=float)[None],
+                               axis=2).min(axis=1)
+    matched = distances[distances <= max_distance]
+    return len(matched), matched.mean() if len(matched) else 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    specks = 0
+    if args[:1] == ['--specks']:
+        specks = int(args[1])
+        args = args[2:]
+    files = args or sorted(glob.glob('test_images/*.jpg') + glob.glob('test_images/perspective/*.jpg'))
+
+    print("{0:<44}{1:>6}{2:>10}{3:>10}{4:>12}{5:>10}{6:>10}{7:>12}".format(
+        "Image", "Scale", "Robots", "Time (ms)", "Error (px)", "Balls", "Time (ms)", "Error (px)"))
+    totals = {scale: [0, 0, 0, 0, 0, 0] for scale in SCALES}
+    for file in files:
+        img_cam = cv2.imread(file)
+        height, width = img_cam.shape[:2]
+        calibration = FieldCalibration(server_settings, rect_from_image_size(width, height))
+        img_grey = threshold_image(img_cam, threshold=server_settings['THRESHOLD'])
+        add_specks(img_grey, specks)
+
+        # Full size detection is the reference. Balls are found after blacking out the robots.
+        img_grey_without_robots = img_grey.copy()
+        reference_markers = detect_markers(img_grey_without_robots, 1, calibration)
+        reference_balls = detect_balls(img_grey_without_robots.copy(), 1, calibration)
+
+        for scale in SCALES:
+            markers_ms = time_ms(lambda: detect_markers(img_grey.copy(), scale, calibration))
+            balls_ms = time_ms(lambda: detect_balls(img_grey_without_robots.copy(), scale, calibration))
+            robot_markers = detect_markers(img_grey.copy(), scale, calibration)
+            balls = detect_balls(img_grey_without_robots.copy(), scale, calibration)
+
+            # Robots must have the same id, balls just have to be close to a reference ball
+            robots_found = [robot_id for robot_id in reference_markers if robot_id in robot_markers]
+            robot_error = np.mean([np.linalg.norm(np.subtract(reference_markers[robot_id], robot_markers[robot_id]))
+                                   for robot_id in robots_found]) if robots_found else 0
+            balls_found, ball_error = match(reference_balls, balls)
+            totals[scale] = np.add(totals[scale], [markers_ms, len(robots_found), len(reference_markers),
+                                                   balls_ms, balls_found, len(reference_balls)])
+
+            print("{0:<44}{1:>6}{2:>10}{3:>10.2f}{4:>12.2f}{5:>10}{6:>10.2f}{7:>12.2f}".format(
+                file[-44:], scale,
+                "{0}/{1}".format(len(robots_found), len(reference_markers)), markers_ms, robot_error,
+                "{0}/{1}".format(balls_found, len(reference_balls)), balls_ms, ball_error))
+
+    print("Totals")
+    for scale, (markers_ms, robots_found, robots, balls_ms, balls_found, balls) in totals.items():
+        print("Scale {0}: {1:.0f}/{2:.0f} robots in {3:.2f} ms, {4:.0f}/{5:.0f} balls in {6:.2f} ms per image".format(
+            scale, robots_found, robots, markers_ms / len(files), balls_found, balls, balls_ms / len(files)))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Compares Transformation and SimilarityTransformation, for single operations
+# and for the geometry computed for each camera frame.
+# Usage: python3 benchmark_transformations.py [number of robots] [number of balls]
+
+import sys
+import timeit
+import numpy as np
+
+import robot_frames
+import parse_camera_data
+from referenceframes.transformations import Transformation, SimilarityTransformation
+from antoncv import rect_from_image_size
+from robot_frames import FieldCalibration
+from settings import server_settings, robot_settings
+
+REPEAT = 2000
+
+
+def time_us(function, number=REPEAT):
+    """Average time of a function call, in microseconds"""
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def random_markers(n_robots, n_balls, seed=0):
+    """Random marker and ball pixel locations for a field of full camera size"""
+    rng = np.random.default_rng(seed)
+    markers = {}
+    for robot_id in range(n_robots):
+        midbase = rng.uniform(100, 1000, 2)
+        heading = rng.uniform(-np.pi, np.pi)
+        apex = midbase + 40 * np.array([np.cos(heading), np.sin(heading)])
+        markers[robot_id] = [tuple(midbase.astype(int)), tuple(apex.astype(int))]
+    balls = [tuple(ball) for ball in rng.uniform(50, 1000, (n_balls, 2)).astype(int)]
+    return markers, balls
+
+
+def use_class(transformation_class):
+    """Make the per-frame geometry use the given transformation class"""
+    robot_frames.SimilarityTransformation = transformation_class
+    parse_camera_data.SimilarityTransformation = transformation_class
+
+
+def frame_geometry(markers, balls, calibration):
+    """All geometry the server computes for each frame: bounding boxes and data for robots"""
+    for midbase, apex in markers.values():
+        parse_camera_data.bounding_box(server_settings, np.array(midbase), np.array(apex), calibration)
+    parse_camera_data.make_data_for_robots(markers, balls, calibration, server_settings, robot_settings,
+                                           [(-200, -200), (200, 200)])
+
+
+if __name__ == '__main__':
+    n_robots = int(sys.argv[1]) if len(sys.argv) > 1 else server_settings['MAX_AGENTS']
+    n_balls = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    rotation = np.array([[0, -1], [1, 0]])
+    translation = np.array([3.0, 4.0])
+    point = np.array([1.0, 2.0])
+    points = np.ones((2, n_balls))
+
+    print("{0:<24}{1:>16}{2:>16}{3:>10}".format("Operation (us)", "Transformation", "Similarity", "Speedup"))
+    for name, operation in [
+            ("construct", lambda T: lambda: T(rotation, translation, 0.5)),
+            ("compose", lambda T: (lambda a, b: lambda: a@b)(T(rotation, translation), T(rotation, translation, 2))),
+            ("inverse", lambda T: (lambda a: lambda: a.inverse())(T(rotation, translation, 0.5))),
+            ("transform point", lambda T: (lambda a: lambda: a*point)(T(rotation, translation, 0.5))),
+            ("transform {0} points".format(n_balls), lambda T: (lambda a: lambda: a*points)(T(rotation, translation))),
+            ("from matrix", lambda T: (lambda m: lambda: T(matrix=m))(T(rotation, translation, 0.5).matrix))]:
+        old = time_us(operation(Transformation))
+        new = time_us(operation(SimilarityTransformation))
+        print("{0:<24}{1:>16.2f}{2:>16.2f}{3:>9.1f}x".format(name, old, new, old / new))
+
+    # The geometry of one frame, with the call counts of the real server
+    markers, balls = random_markers(n_robots, n_balls)
+    field_corners = rect_from_image_size(server_settings['WIDTH'], server_settings['HEIGHT'])
+    results = []
+    for transformation_class in (Transformation, SimilarityTransformation):
+        use_class(transformation_class)
+        calibration = FieldCalibration(server_settings, field_corners)
+        results.append(time_us(lambda: frame_geometry(markers, balls, calibration), number=50) / 1000)
+    use_class(SimilarityTransformation)
+    print("{0:<24}{1:>16.2f}{2:>16.2f}{3:>9.1f}x".format("frame (ms)", results[0], results[1],
+                                                         results[0] / results[1]))
+    print("Frame: {0} robots, {1} balls".format(n_robots, n_balls))
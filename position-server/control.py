@@ -0,0 +1,71 @@
+"""Commands for the position server, from keys in the preview window or over UDP
+
+A command is one of the keys of the preview window, like f for flocking or q to stop.
+Without a window, send them over UDP, for example: echo -n f | nc -u -w0 127.0.0.1 50200
+"""
+
+import socket
+import logging
+from queue import Queue, Empty
+from threading import Thread
+
+# Robot states set by commands
+STATES = {'f': 'flocking',
+          'b': 'drive',
+          's': 'seek ball',
+          'l': 'straight line'}
+
+
+class ControlThread(Thread):
+    """Receives commands on a UDP port, and collects them with those from the window, for the main loop"""
+
+    # Seconds to wait for a command before checking if we should still be running
+    poll_time = 0.5
+
+    def __init__(self, address='127.0.0.1', port=50200):
+        Thread.__init__(self, name='control', daemon=True)
+        self.commands = Queue()
+        self.running = True
+
+        self.socket = None
+        if port:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                self.socket.bind((address, port))
+            except OSError as exc:
+                # Another server has the port. The keys in the window still work.
+                logging.warning("No commands over UDP, can't use {0}:{1}: {2}".format(address, port, exc))
+                self.socket.close()
+                self.socket = None
+                return
+            self.socket.settimeout(self.poll_time)
+            logging.info("Commands on UDP {0}:{1}".format(address, port))
+
+    def put(self, command):
+        """Add a command, like a key pressed in the window"""
+        self.commands.put(command)
+
+    def pending(self):
+        """All commands that came in since the last call, without waiting"""
+        commands = []
+        while True:
+            try:
+                commands.append(self.commands.get_nowait())
+            except Empty:
+                return commands
+
+    def run(self):
+        if self.socket is None:
+            return
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(64)
+            except socket.timeout:
+                continue
+            for command in data.decode(errors='ignore').strip('\r\n'):
+                self.put(command)
+        self.socket.close()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,222 @@
+"""Find robot markers and balls in the thresholded, warped camera image
+
+Nothing is drawn here, see preview.py for that.
+"""
+
+import cv2
+import numpy as np
+
+from antoncv import downscale_binary, contour_regions, contour_points, contour_boxes, enclosing_circles
+from parse_camera_data import bounding_boxes
+
+
+# Code dots, relative to the midbase of a marker, in lengths of its base
+CODE_DOT_POSITIONS = np.array([[0.4, 0.5],
+                               [0.125, 0.5],
+                               [-0.125, 0.5],
+                               [-0.4, 0.5]])
+
+# The corner opposite each side of a triangle: ab, bc and ac
+OPPOSITE_CORNER = np.array([2, 0, 1])
+
+
+def decode_markers(img_grey, triangles, sample_radius=0):
+    """Robot ids, midbases, apexes, headings and id confidences of all triangle markers at once
+
+    Each code dot is read as the majority of the pixels within sample_radius of it. The confidence of an id
+    is that of its least certain dot: 1 if all its pixels agree, 0 if half of them are black.
+    Triangles of which the equal sides are not so equal are skipped. The id is -1 if a code dot is outside the image.
+    Returns arrays of shape (N,), (N, 2), (N, 2), (N,) and (N,).
+    """
+    if not len(triangles):
+        return np.zeros(0, dtype=int), np.zeros((0, 2), dtype=int), np.zeros((0, 2), dtype=int), np.zeros(0), \
+            np.zeros(0)
+
+    # Corners a, b and c of each triangle, and the lengths of sides ab, bc and ac
+    corners = np.array(triangles).reshape((-1, 3, 2))
+    lengths = np.linalg.norm(corners[:, [0, 1, 0]] - corners[:, [1, 2, 2]], axis=2)
+
+    # If the equal sides are not so equal, skip this triangle...
+    sorted_lengths = np.sort(lengths, axis=1)
+    isosceles = sorted_lengths[:, 1] * 1.09 >= sorted_lengths[:, 2]
+    corners, lengths, shortest = corners[isosceles], lengths[isosceles], sorted_lengths[isosceles, 0]
+
+    # The apex is opposite the shortest side, the midbase is in the middle of it
+    apexes = corners[np.arange(len(corners)), OPPOSITE_CORNER[lengths.argmin(axis=1)]]
+    midbases = ((corners.sum(axis=1) - apexes) / 2).astype(int)
+
+    # Find the direction in which the triangles are pointing, like atan2_vec
+    directions = apexes - midbases
+    headings = -np.arctan2(directions[:, 1], directions[:, 0])
+
+    # Rotate the code dot positions with the heading of each marker: (N, 4) pixel locations
+    c = np.cos(headings)[:, np.newaxis] * shortest[:, np.newaxis]
+    s = np.sin(headings)[:, np.newaxis] * shortest[:, np.newaxis]
+    across, along = CODE_DOT_POSITIONS.T
+    xs = (midbases[:, 0:1] - across * s - along * c).astype(int)
+    ys = (midbases[:, 1:2] - across * c + along * s).astype(int)
+
+    # The pixels around each dot: (N, 4, pixels)
+    offsets = np.arange(-sample_radius, sample_radius + 1)
+    dx, dy = np.meshgrid(offsets, offsets)
+    xs = xs[:, :, np.newaxis] + dx.ravel()
+    ys = ys[:, :, np.newaxis] + dy.ravel()
+
+    # Read all code pixels, black is a 1. Dots outside the image are read at the edge, but make the id invalid.
+    img_height, img_width = img_grey.shape[:2]
+    inside = ((xs >= 0) & (xs < img_width) & (ys >= 0) & (ys < img_height)).all(axis=(1, 2))
+    black = (img_grey[ys.clip(0, img_height - 1), xs.clip(0, img_width - 1)] == 0).mean(axis=2)
+    robot_ids = np.where(inside, (black > 0.5) @ (1 << np.arange(4)), -1)
+    confidences = np.where(inside, np.abs(2 * black - 1).min(axis=1), 0)
+
+    return robot_ids, midbases, apexes, headings, confidences
+
+
+def resolve_duplicates(robot_ids, scores):
+    """Only the marker with the highest score keeps an id that was found more than once, the others get -1"""
+    robot_ids = robot_ids.copy()
+    for robot_id in np.unique(robot_ids[robot_ids >= 0]):
+        duplicates = np.flatnonzero(robot_ids == robot_id)
+        if len(duplicates) > 1:
+            robot_ids[np.delete(duplicates, scores[duplicates].argmax())] = -1
+    return robot_ids
+
+
+def find_robot_markers(img_grey, triangles, server_settings, calibration, field_warp=None, id_voting=None):
+    """Decode robot ids from triangle markers and black out the robots in the greyscale image
+
+    If a field_warp is given, the images are unwarped camera images and the markers are returned in
+    warped image coordinates, as if they were found in the warped image.
+    With an IdVoting, the id of each marker is voted on over the last frames.
+    When two markers have the same id, the one with the most confidence keeps it and the other gets -1.
+    """
+    robot_ids, midbases, apexes, headings, confidences = decode_markers(img_grey, triangles,
+                                                                        server_settings['CODE_DOT_SAMPLE_RADIUS'])
+    if not len(robot_ids):
+        if id_voting is not None:
+            id_voting.vote(robot_ids, confidences, midbases)
+        return {}
+
+    if field_warp is not None:
+        # Only warp the marker locations, not the whole image
+        midbases = field_warp.to_field(midbases).astype(int)
+        apexes = field_warp.to_field(apexes).astype(int)
+
+    if id_voting is not None:
+        robot_ids, confidences = id_voting.vote(robot_ids, confidences, midbases)
+    robot_ids = resolve_duplicates(robot_ids, confidences)
+
+    # Black out the shape of the robots in our source image
+    boxes = bounding_boxes(server_settings, midbases, apexes, calibration)
+    if field_warp is not None:
+        boxes = field_warp.to_camera(boxes.reshape((-1, 2))).astype(int).reshape(boxes.shape)
+    for bb in boxes:
+        cv2.fillConvexPoly(img_grey, bb, 255)
+
+    # Triangle Center and Top with origin at bottom left, for each robot
+    return {robot_id: [tuple(midbase), tuple(apex)]
+            for robot_id, midbase, apex in zip(robot_ids.tolist(), midbases.tolist(), apexes.tolist())}
+
+
+def find_balls(img_grey, server_settings, calibration, found_playing_field, scale=1, field_warp=None):
+    """Find balls in the greyscale image, after the robots have been blacked out
+
+    With a scale above 1, ball sized blobs are found in a downscaled image first.
+    If a field_warp is given, the images are unwarped camera images and the balls are returned in
+    warped image coordinates, as if they were found in the warped image.
+    Returns an (M, 2) array of ball centres.
+    """
+    if found_playing_field:
+        # Erase the ball depot and everything outside the playing field
+        cv2.bitwise_or(img_grey, outside_field_mask(img_grey.shape, server_settings, calibration, field_warp),
+                       dst=img_grey)
+
+    # Now all robots & border are blacked out let's look for contours again.
+    img_height, img_width = img_grey.shape[:2]
+    if scale > 1:
+        # Only look closely where there is something no larger than a ball, and not just a speck,
+        # in the downscaled image.
+        # Balls with a highlight can fall apart in smaller pieces there, so look around them with a ball radius.
+        img_small = downscale_binary(img_grey, scale)
+        img_small, contours, tree = cv2.findContours(img_small, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        candidates = []
+        if contours:
+            points, starts = contour_points(contours)
+            indices, centres, radii = enclosing_circles(points, starts, 1,
+                                                        server_settings['MAX_BALL_RADIUS_PX'] / scale + 2)
+            candidates = [contours[i] for i in indices]
+        regions = contour_regions(candidates, scale, server_settings['MAX_BALL_RADIUS_PX'], img_grey.shape)
+    else:
+        regions = [(0, 0, img_width, img_height)]
+
+    balls, radii = find_circles_in_regions(img_grey, regions,
+                                           server_settings['MIN_BALL_RADIUS_PX'],
+                                           server_settings['MAX_BALL_RADIUS_PX'],
+                                           field_warp)
+
+    # Balls in overlapping regions are found more than once. Keep the first of each.
+    unique_balls, first = np.unique(balls, axis=0, return_index=True)
+    return balls[np.sort(first)]
+
+
+def outside_field_mask(shape, server_settings, calibration, field_warp=None):
+    """Image that is white outside the playing field and on the ball depot
+
+    It is made once for each calibration and image size, and then kept in the calibration.
+    """
+    key = (shape, field_warp, server_settings['depot_radius'])
+    if key not in calibration.masks:
+        img_height, img_width = shape[:2]
+        mask = np.zeros((img_height, img_width), dtype=np.uint8)
+        if field_warp is None:
+            cv2.fillConvexPoly(mask, calibration.field_corners.astype(int), 255)
+            cv2.bitwise_not(mask, dst=mask)
+            cv2.circle(mask, (img_width // 2, 0), server_settings['depot_radius'], 255, cv2.FILLED)
+        else:
+            # The same, with the field edges and the depot in the camera image
+            cv2.fillConvexPoly(mask, field_warp.to_camera(calibration.field_corners).astype(int), 255)
+            cv2.bitwise_not(mask, dst=mask)
+            depot = cv2.ellipse2Poly((field_warp.size[0] // 2, 0), (server_settings['depot_radius'],) * 2, 0, 0, 360, 5)
+            cv2.fillPoly(mask, [field_warp.to_camera(depot).astype(int)], 255)
+        calibration.masks[key] = mask
+    return calibration.masks[key]
+
+
+def find_circles_in_regions(img_grey, regions, min_radius, max_radius, field_warp=None):
+    """Enclosing circles of contours in rectangles (x0, y0, x1, y1) of the image, with a radius in range
+
+    Contours cut off by the edge of their region are skipped, unless that edge is the edge of the image.
+    If a field_warp is given, the contours are warped first, and the circles are in the warped image.
+    Returns their centres (K, 2), rounded down to whole pixels, and radii (K,).
+    """
+    img_height, img_width = img_grey.shape[:2]
+    contours, region_numbers = [], []
+    for number, (x0, y0, x1, y1) in enumerate(regions):
+        region_grey = img_grey[y0:y1, x0:x1]
+        if region_grey.shape != img_grey.shape:
+            # Copy the region, findContours may change its input
+            region_grey = region_grey.copy()
+        region_grey, region_contours, tree = cv2.findContours(region_grey, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE,
+                                                              offset=(x0, y0))
+        contours += region_contours
+        region_numbers += [number] * len(region_contours)
+    if not contours:
+        return np.zeros((0, 2), dtype=int), np.zeros(0)
+
+    # Look at the contours of all regions at once, and only fit circles to the ones that can be a ball
+    points, starts = contour_points(contours)
+    whole = ~cut_off(*contour_boxes(points, starts), np.array(regions)[region_numbers].T, img_width, img_height)
+    if field_warp is not None:
+        points = field_warp.to_field(points)
+    indices, centres, radii = enclosing_circles(points, starts, min_radius, max_radius, whole)
+    return centres.astype(int), radii
+
+
+def cut_off(lows, highs, regions, img_width, img_height):
+    """For contours with bounding boxes from lows to highs, True if one touches an edge of its region
+    that is not an edge of the image. Regions are the x0, y0, x1 and y1 of the region of each contour."""
+    x, y = lows.T
+    x_end, y_end = highs.T + 1
+    x0, y0, x1, y1 = regions
+    return ((x0 > 0) & (x <= x0 + 1)) | ((y0 > 0) & (y <= y0 + 1)) | \
+        ((x1 < img_width) & (x_end >= x1 - 1)) | ((y1 < img_height) & (y_end >= y1 - 1))
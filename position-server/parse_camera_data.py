@@ -1,30 +1,48 @@
 import numpy as np
-from robot_frames import transform_to_world_from_marker_pixels, transform_to_world_from_ball_pixels, transform_to_world_from_bot, transform_to_gripper_from_bot, transform_to_world_from_bounding_pixels
+from referenceframes.transformations import SimilarityTransformation
+from robot_frames import transform_to_world_from_bot, stack_to_world_from_bot, stack_inverse
 
-def bounding_box(server_settings, midbase_marker, apex_marker, field_corners):
+def bounding_box(server_settings, midbase_marker, apex_marker, calibration):
     """Convert marker midbase and apex pixel location into bounding box, in pixels"""
-    
+
     # Get transformation matrix from pixels to world frame
-    H_to_world_from_marker_pixels = transform_to_world_from_marker_pixels(server_settings, field_corners)
-    
+    H_to_world_from_marker_pixels = calibration.H_to_world_from_marker_pixels
+
     # Obtain transformation matrix between the robot and the world, for this robot
     H_to_world_from_bot = transform_to_world_from_bot(server_settings, 
                                                       H_to_world_from_marker_pixels*midbase_marker, # Midbase marker in world
                                                       H_to_world_from_marker_pixels*apex_marker) # Apex marker in world
 
-    # Matrix of bounding box locations, in the robot frame
-    bounding_box_in_robot = np.array(server_settings['bounding_box_cm']).T
     # Matrix of bounding box locations, in the world frame
-    bounding_box_in_world = H_to_world_from_bot*bounding_box_in_robot
+    bounding_box_in_world = H_to_world_from_bot*calibration.bounding_box_in_robot
     # Matrix of bounding box locations, in pixels concerning bounding box
-    H_to_world_from_bounding_pixels = transform_to_world_from_bounding_pixels(server_settings, field_corners)
-    bounding_box_in_bounding_pixels = H_to_world_from_bounding_pixels.inverse()*bounding_box_in_world
+    bounding_box_in_bounding_pixels = calibration.H_to_bounding_pixels_from_world*bounding_box_in_world
     # Revert the indexing so this can be seen as a list of coordinates
     return (bounding_box_in_bounding_pixels.T).astype(int)
 
-def get_depot_info(H_to_bot_from_world, server_settings, sort_by_distance=False):
+
+def bounding_boxes(server_settings, midbase_markers, apex_markers, calibration):
+    """Bounding boxes of many robots at once, like bounding_box. Returns an (N, corners, 2) array of pixels."""
+    n_robots = len(midbase_markers)
+    H_to_world_from_marker_pixels = calibration.H_to_world_from_marker_pixels
+
+    # Marker locations of all robots in the world, one row per robot
+    midbase_world = (H_to_world_from_marker_pixels*np.array(midbase_markers, dtype=float).T).reshape((2, n_robots)).T
+    apex_world = (H_to_world_from_marker_pixels*np.array(apex_markers, dtype=float).T).reshape((2, n_robots)).T
+    H_to_world_from_bot = stack_to_world_from_bot(server_settings, midbase_world, apex_world)
+
+    # Bounding box corners of all robots in the world: (2, N*corners)
+    bounding_box_in_world = H_to_world_from_bot[:, 0:2, 0:2]@calibration.bounding_box_in_robot + \
+        H_to_world_from_bot[:, 0:2, 2:3]
+    bounding_box_in_world = bounding_box_in_world.transpose((1, 0, 2)).reshape((2, -1))
+
+    # In pixels, one row of corners per robot
+    bounding_box_in_bounding_pixels = calibration.H_to_bounding_pixels_from_world*bounding_box_in_world
+    return bounding_box_in_bounding_pixels.reshape((2, n_robots, -1)).transpose((1, 2, 0)).astype(int)
+
+def get_depot_info(H_to_bot_from_world, calibration, sort_by_distance=False):
     # Load the absolute depot locations
-    depot_locations_world = np.array(server_settings['depots_world']).T
+    depot_locations_world = calibration.depots_world
 
     # Empty dictionary which we'll fill for each agent in this loop
     depots_agents = {}
@@ -48,59 +66,82 @@ def get_depot_info(H_to_bot_from_world, server_settings, sort_by_distance=False)
             
     return depots_agents
 
-def get_ball_info(H_to_bot_from_world, ball_locations, server_settings, field_corners):
-    sorted_balls_relative_to_gripper = {}
-    if len(ball_locations) > 0:
-        # Get transformation matrix from pixels to world frame
-        H_to_world_from_ball_pixels = transform_to_world_from_ball_pixels(server_settings, field_corners)
-
-        # Matrix of balls, in pixels
-        balls_pixels = np.array(ball_locations).T
-
-        # Matrix of balls, in world frame
-        balls_world = H_to_world_from_ball_pixels*balls_pixels
-
-        # Transformation from base frame to frame at gripper
-        H_to_gripper_from_bot = transform_to_gripper_from_bot(server_settings)
-
-        # Empty dictionary to fill during loop below
-
-        for (agent, transformation) in H_to_bot_from_world.items():
-            # Matrix of balls, transformed to the agent frame
-            balls_relative_to_gripper = (H_to_gripper_from_bot@transformation)*balls_world
-
-            # Scalar distance to the ball as seen from the current agent
-            distances = np.linalg.norm(balls_relative_to_gripper, axis=0)
-            # Sort by distance
-            sorted_index = np.argsort(distances)
-            n_balls_found = len(sorted_index)
-
-            # Get only the closed balls to reduce data transmission:
-            max_balls_send = server_settings['ball_info_max_size']
-
-            if n_balls_found > max_balls_send:
-                # If we see more balls than we can send, reduce data set
-                sorted_index = sorted_index[0:max_balls_send]
-
-            # Rebuild the array in order of distance
-            sorted_balls_relative_to_gripper[agent] = [balls_relative_to_gripper[:,index].tolist() for index in sorted_index]
-
-            # Balls DEBUG. Leave this here for now so I can uncomment if needed during debugging
-            # if agent == 3:
-            #     abs_balls = [balls_world[:,index] for index in sorted_index]
-            #     gripper_balls = [balls_relative_to_gripper[:,index] for index in sorted_index]
-            #     print("----")
-            #     print(abs_balls)
-            #     print(gripper_balls)
-            #     pass
-
-    # For each agent, return a sorted list of ball locations
-    else:
-        for (agent, transformation) in H_to_bot_from_world.items():
-            sorted_balls_relative_to_gripper[agent] = []
-    return sorted_balls_relative_to_gripper
-
-def get_wall_info(H_to_bot_from_world, server_settings, field_corners):
+def get_ball_info(H_to_bot_from_world, ball_locations, server_settings, calibration, ball_ids=None, targets=None):
+    """The ball_info_max_size balls nearest to the gripper of each robot, in its gripper frame, sorted by distance
+
+    The balls are put in the world frame once. The nearest ones to all grippers are picked from one matrix of
+    distances, without sorting all balls, and only those are transformed into each robot frame.
+    With the ids of the balls from a BallTracker and its targets, {robot_id: ball_id}, each robot gets a ball
+    of its own to go for first in its list, see assign_targets. The targets are updated.
+    """
+    agents = list(H_to_bot_from_world.keys())
+    n_balls = len(ball_locations)
+    n_nearest = min(server_settings['ball_info_max_size'], n_balls)
+    if not agents or not n_nearest:
+        return {agent: [] for agent in agents}
+
+    # Balls in the world frame, one row per ball
+    balls_world = (calibration.H_to_world_from_ball_pixels*np.array(ball_locations, dtype=float).T).reshape((2, n_balls)).T
+
+    # Transformations from the world to the gripper of each robot: (N,3,3). They are not scaled.
+    H_to_gripper_from_world = np.array([(calibration.H_to_gripper_from_bot@transformation).matrix
+                                        for transformation in H_to_bot_from_world.values()])
+    rotations = H_to_gripper_from_world[:, 0:2, 0:2]
+    translations = H_to_gripper_from_world[:, 0:2, 2]
+
+    # Gripper of each robot in the world, where the transformation gives the origin: (N,2)
+    grippers_world = -np.einsum('iba,ib->ia', rotations, translations)
+
+    # Squared distance from each gripper to each ball, less that of the gripper to the origin: (N,M)
+    distances = (balls_world**2).sum(axis=1) - 2*grippers_world@balls_world.T
+
+    # Take the nearest ball of each robot a few times, instead of sorting all balls
+    nearest = np.empty((len(agents), n_nearest), dtype=int)
+    robots = np.arange(len(agents))
+    if targets is not None:
+        target_balls = assign_targets(agents, distances + (grippers_world**2).sum(axis=1)[:, np.newaxis],
+                                      ball_ids, targets, server_settings['BALL_TARGET_SWITCH'])
+        nearest[:, 0] = target_balls
+        distances[robots, target_balls] = np.inf
+    for i in range(0 if targets is None else 1, n_nearest):
+        nearest[:, i] = distances.argmin(axis=1)
+        distances[robots, nearest[:, i]] = np.inf
+
+    # Only the nearest balls, in the gripper frame of each robot: (N,n_nearest,2)
+    balls_relative_to_gripper = np.einsum('iab,ikb->ika', rotations, balls_world[nearest]) + \
+        translations[:, np.newaxis, :]
+
+    # For each agent, a sorted list of ball locations
+    balls_relative_to_gripper = balls_relative_to_gripper.tolist()
+    return {agent: balls_relative_to_gripper[i] for i, agent in enumerate(agents)}
+
+def assign_targets(agents, distances, ball_ids, targets, switch):
+    """The ball each robot goes for, from the squared distances (N, M) of the robots to the balls
+
+    Robots and balls are paired nearest first, each ball to one robot, like a greedy auction. The ball a robot had
+    in targets counts as switch times as far, so robots do not swap balls that are about as near.
+    When there are more robots than balls, the others go for their nearest ball. The targets are updated.
+    """
+    costs = distances.copy()
+    index_of_id = {ball_id: i for i, ball_id in enumerate(np.asarray(ball_ids).tolist())}
+    for robot, agent in enumerate(agents):
+        target = index_of_id.get(targets.get(agent))
+        if target is not None:
+            costs[robot, target] *= switch**2
+
+    # Take the nearest pair of a robot and a ball that are both still free, until either runs out
+    target_balls = costs.argmin(axis=1)
+    for i in range(min(costs.shape)):
+        robot, ball = np.unravel_index(costs.argmin(), costs.shape)
+        target_balls[robot] = ball
+        costs[robot, :] = np.inf
+        costs[:, ball] = np.inf
+
+    targets.clear()
+    targets.update(zip(agents, np.asarray(ball_ids)[target_balls].tolist()))
+    return target_balls
+
+def get_wall_info(H_to_bot_from_world, server_settings, calibration):
     #               world x
     # 
     #            --------->
@@ -115,14 +156,8 @@ def get_wall_info(H_to_bot_from_world, server_settings, field_corners):
     #    +----------------------+
     #  D                          C
 
-    # Corner locations, in pixels
-    corners_pixels = np.array(field_corners).T
-
-    # Get transformation matrix from pixels to world frame
-    H_to_world_from_marker_pixels = transform_to_world_from_marker_pixels(server_settings, field_corners)        
-
     # Corner locations, in world
-    corners_world = H_to_world_from_marker_pixels*corners_pixels
+    corners_world = calibration.corners_world
 
     # Gripper in agent frame
     my_gripper = np.array(server_settings['p_bot_gripper'])
@@ -195,8 +230,8 @@ def intersection(L1, L2):
         return False
 
 def get_line_info(H_to_bot_from_world, server_settings, line):
-    # Load the absolute depot locations
-    line_points_world = np.array(line).T
+    # Load the absolute line end points, one point per row
+    line_points_world = np.array(line)
 
     # Gripper in agent frame
     my_gripper = np.array(server_settings['p_bot_gripper'])
@@ -212,78 +247,159 @@ def get_line_info(H_to_bot_from_world, server_settings, line):
 
         L1 = line_coefs(line[0], line[1])
         line_vec = (line_points_world[1] - line_points_world[0])
-        line_vec_perp = np.array(-line_vec[1], line_vec[0])
+        line_vec_perp = np.array([-line_vec[1], line_vec[0]])
         line_vec_perp_from_gripper = my_gripper_world + line_vec_perp
 
         L2 = line_coefs(my_gripper_world, line_vec_perp_from_gripper)
         closest_point = np.array(intersection(L1,L2))
         closest_point_agent_frame = transformation * closest_point
 
-        line_info[agent] = {'endpoint': endpoint_agent_frame, 'closest_point': closest_point_agent_frame}
+        line_info[agent] = {'endpoint': endpoint_agent_frame.tolist(),
+                            'closest_point': closest_point_agent_frame.tolist()}
 
     return line_info
 
 
-def get_neighbor_info(markers, server_settings, field_corners):
+def stack_robot_frames(markers, server_settings, calibration):
+    """Robot ids, and the transformation matrices from each robot to the world as a (N,3,3) stack"""
     # Determine who's who
-    agents = markers.keys()
+    agents = list(markers.keys())
+    n_agents = len(agents)
 
     # Get transformation matrix from pixels to world frame
-    H_to_world_from_marker_pixels = transform_to_world_from_marker_pixels(server_settings, field_corners)    
+    H_to_world_from_marker_pixels = calibration.H_to_world_from_marker_pixels
 
-    # Obtain transformation matrix between the robot and the world, for each robot
-    H_to_world_from_bot = {i: transform_to_world_from_bot(server_settings, 
-                                                          H_to_world_from_marker_pixels*midbase_marker, # Midbase marker in world
-                                                          H_to_world_from_marker_pixels*apex_marker) # Apex marker in world
-                            for i, [midbase_marker, apex_marker] in markers.items()}
+    # Marker locations of all robots in the world, one row per robot
+    markers_pixels = np.array([markers[i] for i in agents], dtype=float).reshape((n_agents, 2, 2))
+    midbase_world = (H_to_world_from_marker_pixels*markers_pixels[:, 0, :].T).reshape((2, n_agents)).T
+    apex_world = (H_to_world_from_marker_pixels*markers_pixels[:, 1, :].T).reshape((2, n_agents)).T
 
-    # Precompute their inverses for later use
-    H_to_bot_from_world = {i: H_to_world_from_bot[i].inverse() for i in agents}                        
+    return agents, stack_to_world_from_bot(server_settings, midbase_world, apex_world)
 
-    # Gripper in agent frame
-    my_gripper = np.array(server_settings['p_bot_gripper'])
-    my_origin = np.array([0, 0])
 
-    # Empty dictionaries that will get an entry for each agent in the loop that follows
-    # For each robot, it contains information about its neighbors, from its own point of view
-    neighbor_info = {}
+def get_neighbor_info(markers, server_settings, calibration):
+    # Obtain transformation matrix between the robot and the world, for all robots at once: (N,3,3)
+    agents, H_to_world_from_bot = stack_robot_frames(markers, server_settings, calibration)
+    rotation_to_world_from_bot = H_to_world_from_bot[:, 0:2, 0:2]
+    translation_to_world_from_bot = H_to_world_from_bot[:, 0:2, 2]
 
-    # Do the following computations for all agents, using the previously computed frame conversions
-    for me in agents:
+    # Precompute their inverses for later use. They are not scaled, so the matrices hold the rotation and translation.
+    # Made from plain lists, which is much faster than from numpy elements.
+    H_to_bot_from_world = {i: SimilarityTransformation((H[0][0:2], H[1][0:2]), (H[0][2], H[1][2]))
+                           for i, H in zip(agents, stack_inverse(H_to_world_from_bot).tolist())}
 
-        # List of everyone except me
-        neighbors = [i for i in agents if me != i]
+    # Grippers, then centers of every robot, in the world: (2N,2)
+    n_agents = len(agents)
+    my_gripper = np.array(server_settings['p_bot_gripper'])
+    grippers_world = rotation_to_world_from_bot@my_gripper + translation_to_world_from_bot
+    points_world = np.concatenate((grippers_world, translation_to_world_from_bot))
 
-        # I need an empty dictionary to store information about all my neighbors
-        neighbor_info[me] = {neighbor : {} for neighbor in neighbors}
+    # Grippers and centers of every robot j, in the reference frame of every robot i: (N,2N,2)
+    points = (points_world[np.newaxis, :, :] - translation_to_world_from_bot[:, np.newaxis, :])@rotation_to_world_from_bot
 
-        # Determine gripper location and other properties of everyone else in my reference frame
-        for neighbor in neighbors:
-            # Transformation from another robot, to my reference frame
-            H_to_me_from_neighbor = H_to_bot_from_world[me]@H_to_world_from_bot[neighbor]
-            # Gripper location of other robot, in my reference frame:
-            neighbor_gripper = H_to_me_from_neighbor*my_gripper
-            neighbor_info[me][neighbor]['gripper_location'] = neighbor_gripper.tolist()
-            # Scalar distance to that gripper
-            distance = np.linalg.norm(neighbor_gripper)
+    # Check if the other grippers are in our "virtual" field of view
+    is_visible = (np.hypot(points[:, :n_agents, 0], points[:, :n_agents, 1]) < server_settings['sight_range']).tolist()
 
-            # Also calculate center localtion
-            neighbor_info[me][neighbor]['center_location'] = (H_to_me_from_neighbor*my_origin).tolist()
-            
-            # Check if that other gripper is in our "virtual" field of view
-            neighbor_info[me][neighbor]['is_visible'] = True if distance < server_settings['sight_range'] else False
+    # Convert to plain lists once, which is much faster than converting each element
+    points = points.tolist()
+
+    # For each robot, a dictionary with information about its neighbors, from its own point of view
+    neighbor_info = {}
+    for me, row, visible in zip(agents, points, is_visible):
+        neighbors = {neighbor: {'gripper_location': gripper,
+                                'center_location': center,
+                                'is_visible': neighbor_visible}
+                     for neighbor, gripper, center, neighbor_visible in zip(agents, row[:n_agents], row[n_agents:],
+                                                                            visible)}
+        del neighbors[me]
+        neighbor_info[me] = neighbors
 
     # Return computed results
     return neighbor_info, H_to_bot_from_world
 
 
-def make_data_for_robots(markers, ball_locations, field_corners, server_settings, robot_settings, line):
+def get_robot_poses(markers, server_settings, calibration):
+    """Position (cm) and heading (rad) of each robot base, in the world frame"""
+    # The robot frames are not scaled, so the matrices hold the rotation and translation as they are
+    agents, H_to_world_from_bot = stack_robot_frames(markers, server_settings, calibration)
+    headings = np.arctan2(H_to_world_from_bot[:, 1, 0], H_to_world_from_bot[:, 0, 0])
+    poses = np.column_stack((H_to_world_from_bot[:, 0:2, 2], headings)).tolist()
+    return dict(zip(agents, poses))
+
+
+def get_robot_motion(markers, motion, server_settings, calibration, in_robot_frame=False):
+    """Velocity (cm/s) and angular velocity (rad/s) of each robot base in the world frame, and seconds since it was seen
+
+    The motion of the markers is in pixels, as estimated by the PoseFilter. With in_robot_frame,
+    the velocity of each robot is in its own frame of reference.
+    Returns {robot_id: [x velocity, y velocity, angular velocity, seconds since seen]}
+    """
+    if not markers:
+        return {}
+    agents, H_to_world_from_bot = stack_robot_frames(markers, server_settings, calibration)
+    marker_motion = np.array([motion[i] for i in agents], dtype=float).reshape((-1, 4))
+
+    # Pixel velocities scale and rotate into the world like the marker locations.
+    # A mirrored image turns the other way.
+    H_to_world_from_marker_pixels = calibration.H_to_world_from_marker_pixels
+    pixels_to_world = H_to_world_from_marker_pixels.matrix[0:2, 0:2]
+    midbase_velocity = marker_motion[:, 0:2]@pixels_to_world.T
+    angular_velocity = marker_motion[:, 2]*np.sign(np.linalg.det(pixels_to_world))
+
+    # The base is offset from the midbase marker, so it moves differently when the robot turns
+    rotation_to_world_from_bot = H_to_world_from_bot[:, 0:2, 0:2]
+    offset = rotation_to_world_from_bot@np.array(server_settings['p_bot_midbase'], dtype=float)
+    velocity = midbase_velocity - angular_velocity[:, np.newaxis]*np.column_stack((-offset[:, 1], offset[:, 0]))
+    if in_robot_frame:
+        velocity = np.einsum('nji,nj->ni', rotation_to_world_from_bot, velocity)
+
+    result = np.column_stack((velocity, angular_velocity, marker_motion[:, 3])).tolist()
+    return dict(zip(agents, result))
+
+
+def make_world_frame(markers, ball_locations, calibration, server_settings, line, motion=None, capture_time=0.0):
+    """Everything the robots need to know, once, in the world frame. Each robot computes its own view.
+
+    The motion of the markers comes from the PoseFilter, the capture time is that of the camera frame.
+    """
+    # Ball locations, in world
+    if len(ball_locations) > 0:
+        balls_world = (calibration.H_to_world_from_ball_pixels*np.array(ball_locations).T).T.tolist()
+    else:
+        balls_world = []
+
+    if motion is None:
+        motion = {robot_id: [0.0, 0.0, 0.0, 0.0] for robot_id in markers}
+
+    return {'time': capture_time,
+            'robots': get_robot_poses(markers, server_settings, calibration),
+            'motion': get_robot_motion(markers, motion, server_settings, calibration),
+            'balls': balls_world,
+            'corners': calibration.corners_world.T.tolist(),
+            'depots': calibration.depots_world.T.tolist(),
+            'line': line}
+
+
+def make_data_for_robots(markers, ball_locations, calibration, server_settings, robot_settings, line,
+                         motion=None, capture_time=0.0, ball_ids=None, targets=None, cache=None):
+    """The data for each robot, in its own frame of reference
+
+    With a GeometryCache, only the parts for robots and balls that moved are computed again.
+    """
+    if cache is not None:
+        cache.check(markers, ball_locations, ball_ids, line, server_settings, calibration)
 
     # Information about the neighbors of each robot, in their own frame of reference
-    neighbor_info, H_to_bot_from_world = get_neighbor_info(markers, server_settings, field_corners)
+    if cache is None or cache.robots_moved:
+        neighbor_info, H_to_bot_from_world = get_neighbor_info(markers, server_settings, calibration)
+    else:
+        neighbor_info, H_to_bot_from_world = cache.neighbor_info, cache.H_to_bot_from_world
 
-    # Get the ball locations in each robot frame, sorted by distance from gripper
-    ball_info = get_ball_info(H_to_bot_from_world, ball_locations, server_settings, field_corners)
+    # Get the ball locations in each robot frame, sorted by distance from gripper, with the ball each robot goes for first
+    if cache is None or cache.robots_moved or cache.balls_moved:
+        ball_info = get_ball_info(H_to_bot_from_world, ball_locations, server_settings, calibration, ball_ids, targets)
+    else:
+        ball_info = cache.ball_info
 
     # # Get depot locations
     # left, top = field_corners[0]
@@ -293,19 +409,169 @@ def make_data_for_robots(markers, ball_locations, field_corners, server_settings
     # depots = [(x * width + left, y * height + top) for x,y in server_settings['depots']]
     # depot_info = get_ball_info(H_to_bot_from_world, depots, server_settings, field_corners)
 
+    # Walls, depots and line only depend on where the robot itself is
+    H_to_moved_from_world = H_to_bot_from_world
+    if cache is not None:
+        H_to_moved_from_world = {agent: H_to_bot_from_world[agent] for agent in cache.moved}
+
     # Get depot locations in each of the robot frames (relative to robot base)
-    depot_info = get_depot_info(H_to_bot_from_world, server_settings)
+    depot_info = get_depot_info(H_to_moved_from_world, calibration)
 
     # Get perpendicular lines to each wall in each robot frame of reference
-    wall_info = get_wall_info(H_to_bot_from_world, server_settings, field_corners)
+    wall_info = get_wall_info(H_to_moved_from_world, server_settings, calibration)
+
+    line_info = get_line_info(H_to_moved_from_world, server_settings, line)
+
+    if cache is not None:
+        neighbor_info, ball_info, depot_info, wall_info, line_info = cache.store(neighbor_info, H_to_bot_from_world,
+                                                                                 ball_info, depot_info, wall_info,
+                                                                                 line_info)
 
-    line_info = get_line_info(H_to_bot_from_world, server_settings, line)
+    # How each robot moves, in its own frame of reference
+    if motion is None:
+        motion = {robot_id: [0.0, 0.0, 0.0, 0.0] for robot_id in markers}
+    motion_info = get_robot_motion(markers, motion, server_settings, calibration, in_robot_frame=True)
 
     result = {}
     for robot_id in markers:
-        result[robot_id] = {'neighbors': neighbor_info[robot_id],
+        vx, vy, angular_velocity, coasting = motion_info[robot_id]
+        result[robot_id] = {'time': capture_time,
+                            'motion': {'velocity': [vx, vy],
+                                       'angular_velocity': angular_velocity,
+                                       'coasting': coasting},
+                            'neighbors': neighbor_info[robot_id],
                             'balls': ball_info[robot_id],
                             'walls': wall_info[robot_id],
                             'depots': depot_info[robot_id],
+                            'line': line_info[robot_id],
                             'robot_settings': robot_settings}
     return result
+
+
+class GeometryCache:
+    """The data for each robot of the last frames, to use again for robots and balls that hardly moved
+
+    Pass it to make_data_for_robots every frame. The walls, depots and line of a robot are computed again when its
+    gripper or rear moved more than threshold cm since they were last computed, or when the field corners or the
+    line ends moved that much as seen from the robot, which is what turning does. The depots are in the field,
+    so they moved less. The neighbors of all robots are computed again when any robot moved, and the balls when
+    a robot or a ball moved. A new calibration, as made when the settings are reloaded, or another line empties
+    the cache.
+    """
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.calibration = None
+        self.line = None
+
+        # Gripper and rear in the world of each robot and the field corners and line ends in its frame,
+        # when its walls, depots and line were computed: {robot_id: (8, 2)}
+        self.points = {}
+        self.walls = {}
+        self.depots = {}
+        self.lines = {}
+
+        # Robots, neighbors and the transformations they came with, of the last time any robot moved
+        self.agents = []
+        self.neighbor_info = {}
+        self.H_to_bot_from_world = {}
+
+        # Balls in the world and their ids, when the ball info was last computed
+        self.balls_world = np.zeros((0, 2))
+        self.ball_ids = None
+        self.ball_info = {}
+
+        # What to compute this frame, and what to remember once it is computed
+        self.moved = []
+        self.robots_moved = True
+        self.balls_moved = True
+        self.pending = {}
+
+        # Statistics: parts reused and parts computed. Walls, depots and line are counted per robot.
+        self.reused = {'walls': 0, 'neighbors': 0, 'balls': 0}
+        self.computed = {'walls': 0, 'neighbors': 0, 'balls': 0}
+
+    def check(self, markers, ball_locations, ball_ids, line, server_settings, calibration):
+        """Find out which robots and balls moved since their data was computed"""
+        if calibration is not self.calibration or line != self.line:
+            self.calibration = calibration
+            self.line = line
+            self.points.clear()
+            self.walls.clear()
+            self.depots.clear()
+            self.lines.clear()
+
+        agents = list(markers.keys())
+        if agents:
+            # Gripper and rear of each robot in the world, and the corners and line ends in its frame: (N, 8, 2)
+            agents, H_to_world_from_bot = stack_robot_frames(markers, server_settings, calibration)
+            H_to_bot_from_world = stack_inverse(H_to_world_from_bot)
+            ends = np.array([server_settings['p_bot_gripper'], server_settings['p_bot_rear']], dtype=float)
+            landmarks = np.vstack((calibration.corners_world.T, np.array(line, dtype=float)))
+            points = np.concatenate((np.einsum('iab,kb->ika', H_to_world_from_bot[:, 0:2, 0:2], ends) +
+                                     H_to_world_from_bot[:, np.newaxis, 0:2, 2],
+                                     np.einsum('iab,kb->ika', H_to_bot_from_world[:, 0:2, 0:2], landmarks) +
+                                     H_to_bot_from_world[:, np.newaxis, 0:2, 2]), axis=1)
+        self.moved = [agent for i, agent in enumerate(agents)
+                      if agent not in self.points or
+                      np.linalg.norm(points[i] - self.points[agent], axis=1).max() > self.threshold]
+
+        # Neighbors change when any robot moved, came or went
+        self.robots_moved = bool(self.moved) or agents != self.agents
+
+        # Nothing is remembered before store: if computing the data fails, this frame is checked again next time
+        self.pending = {'agents': agents,
+                        'points': {agent: points[agents.index(agent)] for agent in self.moved}}
+
+        # Balls change when one moved, came or went
+        balls_world = (calibration.H_to_world_from_ball_pixels *
+                       np.array(ball_locations, dtype=float).reshape((-1, 2)).T).reshape((2, -1)).T
+        if ball_ids is not None:
+            same_balls = self.ball_ids is not None and np.array_equal(ball_ids, self.ball_ids)
+        else:
+            same_balls = self.ball_ids is None and len(balls_world) == len(self.balls_world)
+        self.balls_moved = not same_balls or \
+            (len(balls_world) > 0 and np.linalg.norm(balls_world - self.balls_world, axis=1).max() > self.threshold)
+        self.pending['balls_world'] = balls_world
+        self.pending['ball_ids'] = None if ball_ids is None else np.array(ball_ids)
+
+    def store(self, neighbor_info, H_to_bot_from_world, ball_info, depot_info, wall_info, line_info):
+        """Keep what was computed this frame, and return the data of all robots"""
+        agents = self.pending['agents']
+        self.reused['walls'] += len(agents) - len(self.moved)
+        self.computed['walls'] += len(self.moved)
+        self.points.update(self.pending['points'])
+        self.walls.update(wall_info)
+        self.depots.update(depot_info)
+        self.lines.update(line_info)
+        for agent in set(self.points) - set(agents):
+            del self.points[agent], self.walls[agent], self.depots[agent], self.lines[agent]
+
+        part = 'neighbors'
+        if self.robots_moved:
+            self.computed[part] += 1
+            self.agents = agents
+            self.neighbor_info = neighbor_info
+            self.H_to_bot_from_world = H_to_bot_from_world
+        else:
+            self.reused[part] += 1
+
+        part = 'balls'
+        if self.robots_moved or self.balls_moved:
+            self.computed[part] += 1
+            self.balls_world = self.pending['balls_world']
+            self.ball_ids = self.pending['ball_ids']
+            self.ball_info = ball_info
+        else:
+            self.reused[part] += 1
+
+        return self.neighbor_info, self.ball_info, self.depots, self.walls, self.lines
+
+    def hit_rate(self, part):
+        """Part of the data that was reused, since the start"""
+        total = self.reused[part] + self.computed[part]
+        return self.reused[part] / total if total else 0.0
+
+    def report(self):
+        return "reused walls, depots and line {0:.0%}, neighbors {1:.0%}, balls {2:.0%}".format(
+            self.hit_rate('walls'), self.hit_rate('neighbors'), self.hit_rate('balls'))
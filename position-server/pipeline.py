@@ -0,0 +1,214 @@
+"""Threaded stages connected by bounded queues, so every stage always works on the freshest frame"""
+
+import time
+import logging
+from collections import deque
+from threading import Thread, Condition, Lock
+
+import numpy as np
+
+
+class DropOldestQueue:
+    """Bounded queue that discards its oldest item when a new one arrives and it is full"""
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.condition = Condition()
+
+        # Called with each item that is discarded
+        self.on_drop = on_drop
+
+        # Number of items that were discarded because the consumer was too slow
+        self.dropped = 0
+
+    def put(self, item):
+        """Add an item, dropping the oldest one if the queue is full"""
+        dropped = None
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        """Take the oldest item from the queue, or None if nothing arrived before the timeout"""
+        with self.condition:
+            if self.condition.wait_for(lambda: self.items, timeout):
+                return self.items.popleft()
+            return None
+
+    @property
+    def depth(self):
+        """Number of items currently waiting in the queue"""
+        return len(self.items)
+
+
+class PipelineStage(Thread):
+    """Thread that takes items from its input queue, processes them, and puts the result in its output queue
+
+    A stage without input queue is a source: its function is called without arguments.
+    If the function returns None or fails, nothing is passed on to the next stage,
+    and on_drop is called with the input item.
+    """
+
+    # Seconds to wait for input before checking if we should still be running
+    poll_time = 0.1
+
+    # Weight of the newest sample in the moving average latency
+    smoothing = 0.1
+
+    def __init__(self, name, function, input_queue=None, output_queue=None, on_drop=None):
+        Thread.__init__(self, name=name, daemon=True)
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.on_drop = on_drop
+        self.running = True
+
+        # Timing statistics
+        self.count = 0
+        self.latency = 0
+        self.max_latency = 0
+
+    def run(self):
+        while self.running:
+            if self.input_queue is None:
+                item = None
+            else:
+                item = self.input_queue.get(timeout=self.poll_time)
+                if item is None:
+                    continue
+
+            start = time.time()
+            try:
+                result = self.function() if self.input_queue is None else self.function(item)
+            except Exception:
+                logging.exception("Pipeline stage {0} failed".format(self.name))
+                result = None
+            self.record(time.time() - start)
+
+            if result is None and item is not None and self.on_drop is not None:
+                self.on_drop(item)
+
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put(result)
+
+    def record(self, elapsed):
+        """Update the latency statistics with the duration of one call"""
+        if self.count == 0:
+            self.latency = elapsed
+        else:
+            self.latency += self.smoothing * (elapsed - self.latency)
+        self.max_latency = max(self.max_latency, elapsed)
+        self.count += 1
+
+    def stop(self):
+        self.running = False
+
+
+class Pipeline:
+    """Chain of pipeline stages. The output of the last stage is available in the output queue."""
+
+    def __init__(self, queue_size=1, on_drop=None):
+        self.queue_size = queue_size
+        # Called with each item that is discarded along the way
+        self.on_drop = on_drop
+        self.stages = []
+        self.queues = []
+        self.start_time = time.time()
+
+    @property
+    def output(self):
+        """Queue where the last stage puts its results"""
+        return self.queues[-1]
+
+    def add_stage(self, name, function, queue_size=None):
+        """Append a stage that processes the output of the previous stage"""
+        input_queue = self.queues[-1] if self.queues else None
+        output_queue = DropOldestQueue(queue_size or self.queue_size, self.on_drop)
+        self.stages.append(PipelineStage(name, function, input_queue, output_queue, self.on_drop))
+        self.queues.append(output_queue)
+
+    def start(self):
+        self.start_time = time.time()
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join()
+
+    def statistics(self):
+        """Per stage latency (s), throughput (items/s), queue depth and dropped items"""
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        return {stage.name: {'latency': stage.latency,
+                             'max_latency': stage.max_latency,
+                             'rate': stage.count / elapsed,
+                             'queue_depth': queue.depth,
+                             'dropped': queue.dropped}
+                for stage, queue in zip(self.stages, self.queues)}
+
+    def report(self):
+        """Statistics as a single line for the log. The slowest stage is the bottleneck."""
+        return ", ".join("{0}: {1:.1f}ms {2:.1f}/s q{3} d{4}".format(name,
+                                                                     stats['latency'] * 1000,
+                                                                     stats['rate'],
+                                                                     stats['queue_depth'],
+                                                                     stats['dropped'])
+                         for name, stats in self.statistics().items())
+
+
+class BufferPool:
+    """Image buffers that are handed out again once released, instead of allocating new ones for every frame
+
+    Buffers taken for a frame are listed in frame['buffers'], and released together
+    when the frame is done, or dropped by the pipeline.
+    """
+
+    def __init__(self, max_free=8):
+        # Free buffers to keep, for each shape
+        self.max_free = max_free
+        self.free = {}
+        self.lock = Lock()
+
+        # Statistics
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """A buffer of the given shape, with undefined contents"""
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            free = self.free.get(key)
+            if free:
+                self.reused += 1
+                return free.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype)
+
+    def release(self, buffer):
+        """Give a buffer back. It must no longer be used."""
+        with self.lock:
+            free = self.free.setdefault((buffer.shape, buffer.dtype), [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+    def take(self, frame, shape, dtype=np.uint8):
+        """Acquire a buffer that is released with the frame"""
+        buffer = self.acquire(shape, dtype)
+        frame.setdefault('buffers', []).append(buffer)
+        return buffer
+
+    def release_frame(self, frame):
+        """Release all buffers of a frame"""
+        for buffer in frame.pop('buffers', []):
+            self.release(buffer)
+
+    def report(self):
+        return "{0} buffers allocated, {1} reused".format(self.allocated, self.reused)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 # Reads webcam data and outputs found triangle markers as an UDP broadcast
-# Use q to stop this script, not ctrl-c!
+# Use q to stop this script, not ctrl-c! Without a window, send it to the control port, see control.py.
 
 ############################################################################
 ############################################################################
@@ -14,23 +14,30 @@ import numpy as np
 import time
 import socket
 import logging
-from threading import Thread
+import os
+import sys
+from copy import deepcopy
+from threading import Thread, Condition
 from platform import platform
-import gzip
 
 from antoncv import find_largest_rectangle_transform, offset_convex_polygon, rect_from_image_size, \
-    find_nested_triangles, YELLOW, RED, PURPLE, GREEN, ORANGE, adjust_curve
-from linalg import atan2_vec, vec_length
+    Thresholder, PerspectiveWarp
+from pipeline import Pipeline, BufferPool
+from recorder import FrameRecorder
+from preview import Preview
+from control import ControlThread, STATES
+from tracking import MarkerTracker, IdVoting, PoseFilter, BallTracker
+from detection import find_robot_markers, find_balls
 
 from importlib import reload
 import settings # This is to make importlib/reload work.
 from settings import server_settings, robot_settings
-from parse_camera_data import make_data_for_robots, bounding_box
+from parse_camera_data import make_data_for_robots, make_world_frame, bounding_boxes, GeometryCache
+from robot_frames import FieldCalibration
 
-try:
-    import cPickle as pickle
-except:
-    import pickle
+# The packet codec is shared with the agents, so it lives with the agent code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent'))
+from packets.codec import encode_robot_frame, encode_world_frame, encode_settings
 
 ############################################################################
 ############################################################################
@@ -38,21 +45,23 @@ except:
 ############################################################################
 ############################################################################
 
+# A window is needed to ask about the playing field, and for the preview in a window
+use_window = server_settings['FIELD_DETECTION'] == 'ask' or server_settings['PREVIEW'] == 'window'
+
 # Initialize output window
-if 'Ubuntu' in platform():
+if not use_window:
+    pass
+elif 'Ubuntu' in platform():
     # On Ubuntu without OpenGL
     cv2.namedWindow("cam")
 else:
     # On Mac with OpenGL
-    cv2.namedWindow("cam", cv2.WINDOW_OPENGL)        
+    cv2.namedWindow("cam", cv2.WINDOW_OPENGL)
 if not server_settings['FILE']:
     cap = cv2.VideoCapture(0)
     cap.set(3, server_settings['WIDTH'])
     cap.set(4, server_settings['HEIGHT'])
 
-# Data & robot settings
-data_to_transmit = {}
-
 # Server
 running = True
 
@@ -76,38 +85,246 @@ class SocketThread(Thread):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Keep world frames sent to a multicast group on the local network
+        self.server_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
         # self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1500)
+
+        # Data for each robot, handed over by the analysis pipeline.
+        # The dictionary is replaced as a whole and never modified after publishing.
+        self.data_to_transmit = {}
+        self.robot_settings = {}
+        self.broadcast_mode = 'robot'
+        self.new_data = False
+        self.condition = Condition()
+
+        # Frame sequence number, and the version of the robot settings the agents should have
+        self.sequence = 0
+        self.settings_version = 0
+        self.sent_settings = None
+        self.settings_sent_time = 0
+
         logging.info("Position broadcast started on UDP")
         Thread.__init__(self)
 
+    def publish(self, data_to_transmit, robot_settings, broadcast_mode='robot'):
+        """Hand over the data of a freshly analysed frame and wake up the broadcast.
+
+        In 'robot' mode, the data is a dictionary with the data for each robot.
+        In 'world' mode, it is a single world frame for all robots.
+        """
+        with self.condition:
+            self.data_to_transmit = data_to_transmit
+            # A copy, so the settings can't change while they are compared and sent
+            self.robot_settings = dict(robot_settings)
+            self.broadcast_mode = broadcast_mode
+            self.sequence += 1
+            self.new_data = True
+            self.condition.notify()
+
+    def stop(self):
+        """Wake up the broadcast so it can see we are no longer running"""
+        with self.condition:
+            self.condition.notify()
+
     def run(self):
-        global data_to_transmit, running
         while running:
-            # This is not very threadsafe, a lock would be better here. But hey, it works.
-            for robot_id_key in data_to_transmit:
-                port = server_settings['SERVER_BASE_PORT']+robot_id_key
-                sent_bytes = self.udp_send_dict_key(data_to_transmit, robot_id_key, port)
-                logging.debug("Sent {0} to port {1}".format(sent_bytes, port))
-            time.sleep(0.06)
+            with self.condition:
+                # Send as soon as a new frame is ready. If none arrives in time,
+                # send the previous data again to keep the robots alive.
+                self.condition.wait_for(lambda: self.new_data or not running,
+                                        server_settings['BROADCAST_KEEPALIVE'])
+                data_to_transmit = self.data_to_transmit
+                robot_settings = self.robot_settings
+                broadcast_mode = self.broadcast_mode
+                sequence = self.sequence
+                self.new_data = False
+
+            # Nothing to send before the first frame is analysed
+            if not data_to_transmit:
+                continue
+
+            # Robot settings only go out when they change, or once in a while for agents that just started
+            if robot_settings != self.sent_settings:
+                self.settings_version += 1
+                self.sent_settings = deepcopy(robot_settings)
+                self.settings_sent_time = 0
+            send_settings = time.time() - self.settings_sent_time > server_settings['SETTINGS_RESEND_INTERVAL']
+            if send_settings:
+                settings_packet = encode_settings(self.sent_settings, self.settings_version, sequence)
+                self.settings_sent_time = time.time()
+
+            if broadcast_mode == 'world':
+                # One world frame for all robots, on a single port
+                address, port = server_settings['WORLD_ADDRESS'], server_settings['WORLD_PORT']
+                try:
+                    if send_settings:
+                        self.udp_send(settings_packet, port, address)
+                    packet = encode_world_frame(data_to_transmit, self.settings_version, sequence)
+                    sent_bytes = self.udp_send(packet, port, address)
+                    logging.debug("Sent {0} to {1}:{2}".format(sent_bytes, address, port))
+                except Exception:
+                    logging.exception("Could not send the world frame")
+            else:
+                # A frame for each robot, on its own port. One bad frame must not stop the others.
+                for robot_id_key in data_to_transmit:
+                    port = server_settings['SERVER_BASE_PORT']+robot_id_key
+                    try:
+                        if send_settings:
+                            self.udp_send(settings_packet, port)
+                        packet = encode_robot_frame(data_to_transmit[robot_id_key], self.settings_version, sequence)
+                        sent_bytes = self.udp_send(packet, port)
+                        logging.debug("Sent {0} to port {1}".format(sent_bytes, port))
+                    except Exception:
+                        logging.exception("Could not send the frame of robot {0}".format(robot_id_key))
         self.server_socket.close()
         logging.info("Socket server stopped")
 
-    def udp_send_dict_key(self, dictionary, key, port):
-        if key in dictionary:
-            data = gzip.compress(pickle.dumps(dictionary[key]))
-            try:
-                if data:
-                    result = self.server_socket.sendto(data, ('255.255.255.255', port))
-                    # print("Sent {0}b to port {1}".format(result, port))
-                    return result
-            except OSError as exc:
-                if exc.errno == 55:
-                    time.sleep(0.1)
-                if exc.errno == 40:
-                    print("Message for {1} too long: {0} bytes".format(len(data), key))
-                else:
-                    # pass
-                    raise
+    def udp_send(self, data, port, address='255.255.255.255'):
+        try:
+            if data:
+                result = self.server_socket.sendto(data, (address, port))
+                # print("Sent {0}b to port {1}".format(result, port))
+                return result
+        except OSError as exc:
+            if exc.errno == 55:
+                time.sleep(0.1)
+            if exc.errno == 40:
+                print("Message for {1} too long: {0} bytes".format(len(data), port))
+            else:
+                # pass
+                raise
+
+############################################################################
+############################################################################
+# Image analysis pipeline stages
+############################################################################
+############################################################################
+
+def grab_frame():
+    """Read a frame from the camera, or from file"""
+    lt = time.time()
+    frame = {'time': lt}
+    if not server_settings['FILE']:
+        # Read straight into a reused buffer
+        ok, img = cap.read(image=buffers.take(frame, camera_shape))
+        if not ok:
+            buffers.release_frame(frame)
+            return None  # and try again.
+    else:
+        img = cv2.imread(server_settings['FILE'])
+
+    elapsed = time.time() - lt
+    if elapsed > 0.1:
+        logging.warning("{0}s for image. Slow camera! Bad cable? No OpenGL?".format(elapsed))
+    else:
+        logging.debug("Got image: {0}".format(elapsed))
+
+    # The raw camera image is kept so we can save a situation to disk.
+    frame['img_cam'] = img
+    return frame
+
+
+def detection_warp():
+    """The field warp, if objects are found in the unwarped camera image and only their locations are warped"""
+    if found_playing_field and server_settings['DETECT_UNWARPED']:
+        return field_warp
+    return None
+
+
+def warp(frame):
+    """Warp the camera image to the playing field
+
+    Nothing is drawn on frame['img'], so without warping it is the camera image itself.
+    With a detection_warp, only the found objects are warped, later.
+    """
+    img_cam = frame['img_cam']
+    if not found_playing_field or detection_warp():
+        frame['img'] = img_cam
+    elif server_settings['WARP_GREY']:
+        frame['img'] = field_warp.warp_grey(img_cam, dst=buffers.take(frame, field_warp.shape))
+    else:
+        frame['img'] = field_warp.warp(img_cam, dst=buffers.take(frame, field_warp.shape + (3,)))
+    return frame
+
+
+def threshold(frame):
+    """Make a black and white version of the warped image"""
+    img = frame['img']
+    frame['img_grey'] = thresholder.threshold(img,
+                                              server_settings['THRESHOLD'],
+                                              server_settings['THRESHOLD_TYPE'],
+                                              server_settings['THRESHOLD_CURVE'],
+                                              dst=buffers.take(frame, img.shape[:2]))
+    return frame
+
+
+def detect_objects(frame):
+    """Find robots and balls in the black and white image"""
+    # Only look for markers near their last location, with a full scan once in a while
+    img_grey, triangles = marker_tracker.find_triangles(frame['img_grey'], frame['time'])
+    logging.debug("Got triangles: {0}".format(time.time() - frame['time']))
+
+    frame['robot_markers'] = find_robot_markers(img_grey, triangles, server_settings, calibration, detection_warp(),
+                                                id_voting)
+    marker_tracker.update(frame['robot_markers'], frame['time'], detection_warp())
+
+    # Found all robots, now let's detect balls.
+    frame['balls'] = find_balls(img_grey, server_settings, calibration, found_playing_field,
+                                server_settings['BALL_DETECTION_SCALE'], detection_warp())
+    logging.debug("Listed balls after: {0}s".format(time.time() - frame['time']))
+    return frame
+
+
+def robot_boxes(markers):
+    """Bounding boxes of the robots, where the balls under them are blacked out"""
+    if not markers:
+        return []
+    midbases, apexes = zip(*markers.values())
+    return bounding_boxes(server_settings, midbases, apexes, calibration)
+
+
+def build_packets(frame):
+    """Compute the data for each robot in its own frame of reference and hand it to the broadcast thread"""
+    # Just define a random line for testing
+    line = [(-200,-200), (200,200)]
+
+    # Smooth the robot poses, estimate their velocity, and keep robots that were missed for a moment
+    markers, motion = pose_filter.update(frame['robot_markers'], frame['time'])
+
+    # Give the balls steady ids, and remember those that are hidden under a robot
+    balls, ball_ids = ball_tracker.update(frame['balls'], frame['time'], robot_boxes(markers))
+
+    # Robots of which the id could not be read still hide balls, but get no data: their id does not fit in a packet
+    markers = {robot_id: marker for robot_id, marker in markers.items() if robot_id >= 0}
+
+    if server_settings['BROADCAST_MODE'] == 'world':
+        # Only the world frame. Each robot computes its own view of it.
+        data_to_transmit = make_world_frame(markers,
+                                            balls,
+                                            calibration,
+                                            server_settings,
+                                            line,
+                                            motion,
+                                            frame['time'])
+    else:
+        # Calculations to save time on client side
+        data_to_transmit = make_data_for_robots(markers,
+                                                balls,
+                                                calibration,
+                                                server_settings,
+                                                robot_settings,
+                                                line,
+                                                motion,
+                                                frame['time'],
+                                                ball_ids,
+                                                ball_tracker.targets,
+                                                geometry_cache)
+
+    socket_server.publish(data_to_transmit, robot_settings, server_settings['BROADCAST_MODE'])
+
+    logging.debug("Listed done calculations: {0}s".format(time.time() - frame['time']))
+    return frame
+
 
 ### Start it all up ###
 if __name__ == '__main__':
@@ -121,11 +338,12 @@ if __name__ == '__main__':
     ############################################################################
     ############################################################################
 
-    objects = 'edges'
+    # Ask the user to confirm the playing field, or take it as found in the first frame
+    field_detection = server_settings['FIELD_DETECTION']
+    objects = 'edges' if field_detection == 'ask' else field_detection
     while True:
         if not server_settings['FILE']:
             ok, img = cap.read()
-            img_cam = np.array(img)  # Duplicate for saving a situation to disk.
             if not ok:
                 continue    #and try again.
         else:
@@ -138,12 +356,18 @@ if __name__ == '__main__':
                                               -server_settings['extra border outside'] + \
                                               server_settings['extra border inside'])
 
-        cv2.imshow("cam", img)
-        # Wait for the 'k' key. Dont use ctrl-c !!!
-        keypress = cv2.waitKey(1000) & 0xFF
+        if field_detection == 'ask':
+            cv2.imshow("cam", img)
+            # Wait for the 'k' key. Dont use ctrl-c !!!
+            keypress = cv2.waitKey(1000) & 0xFF
+        else:
+            keypress = ord('n') if field_detection == 'none' else ord('y')
+            logging.info("Playing field: {0}".format(field_detection))
 
         if keypress == ord('y'):
             found_playing_field = True
+            # Lookup tables for warping each frame to the playing field
+            field_warp = PerspectiveWarp(M, maxWidth, maxHeight)
             break
         elif keypress == ord('e'):
             objects = 'edges'
@@ -155,203 +379,129 @@ if __name__ == '__main__':
             field_corners = rect_from_image_size(server_settings['WIDTH'], server_settings['HEIGHT'])
             break
 
+    # Frames are read into buffers of this size
+    camera_shape = img.shape
+
     ############################################################################
     ############################################################################
     # Now we run the main image analysis loop, looking for balls and robots
     ############################################################################
     ############################################################################
 
+    # Transformations that only depend on the playing field and the settings
+    calibration = FieldCalibration(server_settings, field_corners)
+    thresholder = Thresholder()
+    marker_tracker = MarkerTracker(server_settings['FULL_SCAN_INTERVAL'],
+                                   server_settings['MARKER_SEARCH_MARGIN'],
+                                   server_settings['MARKER_DETECTION_SCALE'])
+    id_voting = IdVoting(server_settings['ID_VOTE_FRAMES'], server_settings['MARKER_SEARCH_MARGIN'])
+    pose_filter = PoseFilter(server_settings['POSE_FILTER_GAIN'], server_settings['MAX_COAST_TIME'])
+    ball_tracker = BallTracker(server_settings['MAX_BALL_RADIUS_PX'] * 2, server_settings['BALL_MEMORY_TIME'])
+    geometry_cache = GeometryCache(server_settings['GEOMETRY_MOVE_THRESHOLD'])
+
+    # Images of a frame are written into buffers that are reused once the frame is shown or dropped.
+    # Their sizes are fixed by the camera and the playing field, so after the first few frames nothing is allocated.
+    buffers = BufferPool()
+
+    # Each stage runs in its own thread. The queues between them drop old frames,
+    # so every stage always works on the freshest frame available.
+    pipeline = Pipeline(queue_size=server_settings['PIPELINE_QUEUE_SIZE'], on_drop=buffers.release_frame)
+    pipeline.add_stage('capture', grab_frame)
+    pipeline.add_stage('warp', warp)
+    pipeline.add_stage('threshold', threshold)
+    pipeline.add_stage('detect', detect_objects)
+    pipeline.add_stage('packets', build_packets)
+    pipeline.start()
+
+    # Saves snapshots, and records all frames if wanted, without holding up the preview.
+    # It takes over the frames from the preview and releases their buffers when it is done with them.
+    recorder = FrameRecorder(release=buffers.release_frame, video_file=server_settings['RECORD_VIDEO'])
+    recorder.start()
+
+    # Shows what was found, drawn at a limited rate on its own thread
+    preview = None
+    if server_settings['PREVIEW'] != 'none':
+        preview = Preview(server_settings['PREVIEW'], server_settings['PREVIEW_FPS'],
+                          server_settings['PREVIEW_ADDRESS'], server_settings['PREVIEW_PORT'])
+        preview.start()
+
+    # Keys from the window and commands over UDP
+    control = ControlThread(server_settings['CONTROL_ADDRESS'], server_settings['CONTROL_PORT'])
+    control.start()
+
     n = server_settings['reload_settings_after_n_loops']             # Number of loops to wait for time calculation
     t = time.time()     # Starttime for calculation
-    while True:
-        lt = time.time()
-        logging.debug("Loop start: {0}".format(time.time()-lt))
-        if not server_settings['FILE']:
-            ok, img = cap.read()
-            if not ok:
-                continue  # and try again.
-        else:
-            img = cv2.imread(server_settings['FILE'])
-
-        elapsed = time.time() - lt
-        if elapsed > 0.1:
-            logging.warning("{0}s for image. Slow camera! Bad cable? No OpenGL?".format(elapsed))
-        else:
-            logging.debug("Got image: {0}".format(elapsed))
-
-        if found_playing_field:
-            img = cv2.warpPerspective(img, M, (maxWidth, maxHeight))
-            logging.debug("Image warped: {0}".format(time.time() - lt))
-
-        robot_markers = {}
-        img_grey, triangles = find_nested_triangles(img, threshold=server_settings['THRESHOLD'])
-        logging.debug("Got triangles: {0}".format(time.time() - lt))
-
-        # img_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # img_grey = adjust_curve(img_grey, 1.4)
-        # values, img_grey = cv2.threshold(img_grey, server_settings['THRESHOLD'], 255, cv2.THRESH_BINARY)
-        # img = cv2.cvtColor(img_grey, cv2.COLOR_GRAY2BGR)
-
-        for triangle in triangles:
-            # Let it's corners be these vectors.
-            a = triangle[0][0]
-            b = triangle[1][0]
-            c = triangle[2][0]
-
-            # Now lets find the middle of the base of the triangle and the apex.
-            equal_sides = lengths = [vec_length(a - b), vec_length(b - c), vec_length(a - c)]
-            shortest = min(lengths)
-            shortest_idx = lengths.index(shortest)
-            equal_sides.pop(shortest_idx)
-            if min(equal_sides) * 1.09 < max(equal_sides):
-                # If the equal sides are not so equal, skip this triangle...
-                continue
-            if shortest_idx == 0:
-                midbase_marker = (a + b) / 2
-                apex_marker = c
-            elif shortest_idx == 1:
-                midbase_marker = (c + b) / 2
-                apex_marker = a
-            else:   # shortest == 'ac':
-                midbase_marker = (a + c) / 2
-                apex_marker = b
-            midbase_marker = midbase_marker.astype(int)
-
-            # Find the direction in which the triangle is pointing
-            heading = atan2_vec(apex_marker - midbase_marker)
-
-            # Rotation matrix for reading code squares
-            c = np.cos(heading)
-            s = np.sin(heading)
-            R = np.array([[-s, -c], [-c, s]])
-
-            # Calculate the relative position of the code dots with some linear algebra.
-            relative_code_positions = np.array([[0.4, 0.5],
-                                                [0.125, 0.5],
-                                                [-0.125, 0.5],
-                                                [-0.4, 0.5]])
-
-            # Do a dot product of the relative positions with the center position,
-            # and offset this back to position of the robot to find matrix of absolute code pixel positions
-            locations = (midbase_marker + np.dot(relative_code_positions * shortest, R)).astype(int)
-
-            # Draw binary robot id marker positions
-            for l in locations:
-                cv2.circle(img, tuple(l), 4, (0, 255, 0), -1)
-
-            # Now check all code pixels and do a binary addition
-            robot_id = 0
-            for i in range(4):
-                try:
-                    p = img_grey[locations[i][1], locations[i][0]]
-                except:
-                    # The needed pixel is probably outside the image.
-                    robot_id = -1
-                    break
-                if not p:
-                    robot_id += 2 ** i
-
-            # Draw the data
-            cv2.putText(img,
-                        u"{0:.2f} rad, code: {1}, x:{2}, y:{3}".format(heading,
-                                                                        robot_id,
-                                                                        midbase_marker[0],
-                                                                        midbase_marker[1]
-                                                                        ),
-                        tuple(midbase_marker),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, PURPLE, 4)
-
-            # Draw the contour of our triangle
-            cv2.drawContours(img, [triangle], -1, GREEN)
-
-            # Black out the shape of the robot in our source image
-            bb = bounding_box(server_settings, midbase_marker, apex_marker, field_corners)
-            cv2.drawContours(img, [bb], 0, RED, 2)
-            cv2.fillConvexPoly(img_grey, bb, 255)
-
-            # Save the data in our dictionary
-            robot_markers[robot_id] = [(midbase_marker[0], midbase_marker[1]),  # Triangle Center with origin at bottom left
-                                        (apex_marker[0], apex_marker[1])]    # Triangle Top with origin at bottom left
-
-        # Found all robots, now let's detect balls.
-        balls = []
-
-        if found_playing_field:
-            # Get the size of the image
-            img_height, img_width = img.shape[:2]
-
-            # Erase the ball depot
-            cv2.circle(img_grey, (img_width // 2, 0), server_settings['depot_radius'], (255,255,255), cv2.FILLED)
-
-            mask = np.zeros((img_height, img_width), dtype=np.uint8)
-            cv2.fillConvexPoly(mask, field_corners.astype(int), 255)
-            cv2.bitwise_not(mask, dst=mask)
-            cv2.bitwise_or(img_grey, mask, dst=img_grey)
-
-        logging.debug("Masked field after: {0}s".format(time.time() - lt))
-        # Now all robots & border are blacked out let's look for contours again.
-        img_grey, contours, tree = cv2.findContours(img_grey, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        for c in contours:
-            c, r = cv2.minEnclosingCircle(c)
-            c = tuple(map(int, c))
-            if server_settings['MIN_BALL_RADIUS_PX'] < r < server_settings['MAX_BALL_RADIUS_PX']:
-                cv2.circle(img, c, int(r), YELLOW, 2)
-                balls += [c]
-
-        logging.debug("Listed balls after: {0}s".format(time.time() - lt))
-
-        # Just define a random line for testing
-        line = [(-200,-200), (200,200)]
+    stopping = False
+    while not stopping:
+        frame = pipeline.output.get(timeout=1)
+        if frame is None:
+            logging.warning("No analysed frame for 1s. Pipeline: {0}".format(pipeline.report()))
+            continue
+        recorder.add(frame)
+        if preview is not None:
+            preview.offer(frame, server_settings, calibration, detection_warp())
+
+        if server_settings['PREVIEW'] == 'window':
+            img = preview.images.get(timeout=0)
+            if img is not None:
+                cv2.imshow("cam", img)
+            # Keys go to the control thread. Dont use ctrl-c !!!
+            keypress = cv2.waitKey(1) & 0xFF
+            if keypress != 0xFF:
+                control.put(chr(keypress))
+
+        # Robot states stay until another command. The settings are replaced, not changed,
+        # because the packet stage and the broadcast thread are reading them.
+        for command in control.pending():
+            if command == 'q':
+                stopping = True
+            elif command in STATES:
+                robot_settings = dict(robot_settings, state=STATES[command])
+            elif command == ' ':
+                # Save an image to disk:
+                recorder.snapshot()
+            else:
+                robot_settings = dict(robot_settings, state='')
 
-        # Calculations to save time on client side
-        data_to_transmit = make_data_for_robots(robot_markers,
-                                                balls,
-                                                field_corners,
-                                                server_settings,
-                                                robot_settings,
-                                                line)
-
-        logging.debug("Listed done calculations: {0}s".format(time.time() - lt))
-
-        # Show all calculations in the preview window
-        # img = cv2.cvtColor(img_grey, cv2.COLOR_GRAY2BGR)
-        cv2.drawContours(img, np.array([field_corners], dtype=int), -1, color=ORANGE, thickness=3)
-        cv2.imshow("cam", img)
-
-        # Wait for the 'q' key. Dont use ctrl-c !!!
-        keypress = cv2.waitKey(1) & 0xFF
-
-        if keypress == ord('q'):
-            break
-        elif keypress == ord('f'):
-            robot_settings['state'] = 'flocking'
-        elif keypress == ord('b'):
-            robot_settings['state'] = 'drive'
-        elif keypress == ord('s'):
-            robot_settings['state'] = 'seek ball'
-        elif keypress == ord('l'):
-            robot_settings['state'] = 'straight line'
-        elif keypress == ord(' '):
-            # Save an image to disk:
-            cv2.imwrite("test_images/{0}.jpg".format(int(time.time())), img_cam)
-        else:
-            robot_settings['state'] = ''
         if n == 0:
             logging.info("Looptime: {0}. Reloading settings.".format((time.time()-t)/server_settings['reload_settings_after_n_loops']))
+            logging.info("Pipeline: {0}. Images: {1}".format(pipeline.report(), buffers.report()))
+            logging.info("Recorder: {0}".format(recorder.report()))
+            logging.info("Marker scans: {0} full, {1} around known robots".format(marker_tracker.full_scans,
+                                                                                 marker_tracker.region_scans))
+            logging.info("Balls: {0}".format(ball_tracker.report()))
+            logging.info("Robot data: {0}".format(geometry_cache.report()))
             reload(settings)
             from settings import server_settings, robot_settings
+            calibration = FieldCalibration(server_settings, field_corners)
+            marker_tracker.full_scan_interval = server_settings['FULL_SCAN_INTERVAL']
+            marker_tracker.search_margin = server_settings['MARKER_SEARCH_MARGIN']
+            marker_tracker.scale = server_settings['MARKER_DETECTION_SCALE']
+            id_voting.history = server_settings['ID_VOTE_FRAMES']
+            id_voting.max_distance = server_settings['MARKER_SEARCH_MARGIN']
+            pose_filter.gain = server_settings['POSE_FILTER_GAIN']
+            pose_filter.max_coast = server_settings['MAX_COAST_TIME']
+            ball_tracker.max_distance = server_settings['MAX_BALL_RADIUS_PX'] * 2
+            ball_tracker.memory = server_settings['BALL_MEMORY_TIME']
+            geometry_cache.threshold = server_settings['GEOMETRY_MOVE_THRESHOLD']
             n = server_settings['reload_settings_after_n_loops']
             t = time.time()
         else:
             n -= 1
 
         # Don't run so often while debugging
-        if 'Ubuntu' in platform():
-            time.sleep(2)   
+        time.sleep(server_settings['LOOP_DELAY'])
 
     # User has hit q. Time to clean up.
+    pipeline.stop()
+    control.stop()
+    if preview is not None:
+        preview.stop()
+    recorder.stop()
     running = False
+    socket_server.stop()
     if not server_settings['FILE']:
         cap.release()
-    cv2.destroyAllWindows()
+    if use_window:
+        cv2.destroyAllWindows()
     logging.info("Cleaned up")
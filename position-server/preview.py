@@ -0,0 +1,151 @@
+"""Draw what the position server found, at a limited rate and on a thread of its own
+
+The image analysis does not draw anything. The preview takes a copy of a frame now and then,
+and draws the robots and balls from the detection results.
+"""
+
+import time
+import logging
+from threading import Thread, Condition
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from antoncv import YELLOW, RED, PURPLE, GREEN, ORANGE
+from linalg import atan2_vec
+from parse_camera_data import bounding_box
+from pipeline import DropOldestQueue
+
+
+def draw_detections(img, robot_markers, balls, server_settings, calibration, field_warp=None):
+    """Draw the playing field, robots and balls on a colour image
+
+    If a field_warp is given, the image is the camera image, and everything is drawn where it is in there.
+    """
+    def to_image(points):
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        if field_warp is not None and len(points):
+            points = field_warp.to_camera(points)
+        return points.astype(int)
+
+    cv2.drawContours(img, [to_image(calibration.field_corners)], -1, color=ORANGE, thickness=3)
+
+    for robot_id, (midbase, apex) in robot_markers.items():
+        midbase, apex = np.array(midbase), np.array(apex)
+        cv2.drawContours(img, [to_image(bounding_box(server_settings, midbase, apex, calibration))], 0, RED, 2)
+        midbase_img, apex_img = to_image([midbase, apex])
+        cv2.arrowedLine(img, tuple(midbase_img), tuple(apex_img), GREEN, 2)
+        cv2.putText(img,
+                    u"{0:.2f} rad, code: {1}, x:{2}, y:{3}".format(atan2_vec(apex - midbase), robot_id,
+                                                                    midbase[0], midbase[1]),
+                    tuple(midbase_img),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, PURPLE, 4)
+
+    for center in to_image(balls):
+        cv2.circle(img, tuple(center), server_settings['MAX_BALL_RADIUS_PX'], YELLOW, 2)
+    return img
+
+
+class Preview(Thread):
+    """Draws the detections on a frame at most max_fps times a second
+
+    With mode 'window', the drawn images are put in the images queue, for the main thread to show:
+    on a Mac, OpenCV windows only work from there.
+    With mode 'mjpeg', they are served as a motion JPEG stream on http://address:port/, for a browser.
+    """
+
+    # Seconds to wait for a frame before checking if we should still be running
+    poll_time = 0.1
+
+    def __init__(self, mode='window', max_fps=10, address='127.0.0.1', port=8000):
+        Thread.__init__(self, name='preview', daemon=True)
+        self.mode = mode
+        self.interval = 1.0 / max_fps
+        self.next_time = 0
+        self.frames = DropOldestQueue(1)
+        self.images = DropOldestQueue(1)
+        self.running = True
+
+        # Newest JPEG image, for the stream
+        self.jpeg = None
+        self.jpeg_number = 0
+        self.condition = Condition()
+
+        self.http_server = None
+        if mode == 'mjpeg':
+            self.http_server = ThreadingHTTPServer((address, port), MJPEGHandler)
+            self.http_server.daemon_threads = True
+            self.http_server.preview = self
+            Thread(target=self.http_server.serve_forever, name='preview http', daemon=True).start()
+            logging.info("Preview on http://{0}:{1}/".format(address, port))
+
+    def offer(self, frame, server_settings, calibration, field_warp=None):
+        """Called with each analysed frame. Only copies its image when a new preview is due."""
+        now = time.time()
+        if now < self.next_time:
+            return
+        self.next_time = now + self.interval
+        self.frames.put((frame['img'].copy(), frame['robot_markers'], frame['balls'],
+                         server_settings, calibration, field_warp))
+
+    def run(self):
+        while self.running:
+            job = self.frames.get(timeout=self.poll_time)
+            if job is None:
+                continue
+            img, robot_markers, balls, server_settings, calibration, field_warp = job
+            if img.ndim == 2:
+                # Warped in greyscale only
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            draw_detections(img, robot_markers, balls, server_settings, calibration, field_warp)
+
+            if self.mode == 'mjpeg':
+                ok, jpeg = cv2.imencode('.jpg', img)
+                with self.condition:
+                    self.jpeg = jpeg.tobytes()
+                    self.jpeg_number += 1
+                    self.condition.notify_all()
+            else:
+                self.images.put(img)
+
+    def next_jpeg(self, number, timeout=1):
+        """The newest JPEG image after the one with the given number, or None if none came in time"""
+        with self.condition:
+            if self.condition.wait_for(lambda: self.jpeg_number > number or not self.running, timeout):
+                return self.jpeg_number, self.jpeg
+            return number, None
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.http_server is not None:
+            self.http_server.shutdown()
+
+
+class MJPEGHandler(BaseHTTPRequestHandler):
+    """Sends the preview images to a browser, each replacing the last"""
+
+    def do_GET(self):
+        preview = self.server.preview
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        number = 0
+        try:
+            while preview.running:
+                number, jpeg = preview.next_jpeg(number)
+                if jpeg is None:
+                    continue
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n')
+                self.wfile.write('Content-Length: {0}\r\n\r\n'.format(len(jpeg)).encode())
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser went away
+            pass
+
+    def log_message(self, format, *args):
+        logging.debug("Preview: " + format % args)
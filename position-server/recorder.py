@@ -0,0 +1,123 @@
+"""Save camera frames to disk on a separate thread, so the image analysis never waits for JPEG encoding"""
+
+import os
+import logging
+from collections import deque
+from threading import Thread, Lock
+
+import cv2
+
+from pipeline import DropOldestQueue
+
+
+class FrameRecorder(Thread):
+    """Keeps the last few frames by reference and writes snapshots or a video of them in the background
+
+    Frames are handed over with add(), and are not copied. The recorder owns them from then on:
+    release is called with a frame when it has left the ring buffer and is no longer being written.
+    With a video_file, every frame is recorded, for replaying with benchmark.py.
+    Frames are skipped when the disk can't keep up.
+    """
+
+    # Seconds to wait for work before checking if we should still be running
+    poll_time = 0.1
+
+    def __init__(self, release=None, ring_size=2, directory='test_images', video_file='', frame_rate=30,
+                 queue_size=8):
+        Thread.__init__(self, name='recorder', daemon=True)
+        self.release = release
+        self.ring = deque()
+        self.ring_size = ring_size
+        self.directory = directory
+        self.video_file = video_file
+        self.frame_rate = frame_rate
+        self.video = None
+
+        # Frames to write. A frame is released when it is written, or dropped from here.
+        # Snapshots have their own queue, so they are not skipped for recording.
+        self.snapshot_queue = DropOldestQueue(queue_size, on_drop=self.done)
+        self.video_queue = DropOldestQueue(queue_size, on_drop=self.done)
+
+        # Number of holders of each frame: the ring and the jobs that still have to write it
+        self.lock = Lock()
+        self.users = {}
+        self.running = True
+
+        # Statistics
+        self.snapshots = 0
+        self.recorded = 0
+
+    def use(self, frame):
+        with self.lock:
+            self.users[id(frame)] = self.users.get(id(frame), 0) + 1
+
+    def done(self, frame):
+        with self.lock:
+            self.users[id(frame)] -= 1
+            if self.users[id(frame)]:
+                return
+            del self.users[id(frame)]
+        if self.release is not None:
+            self.release(frame)
+
+    def add(self, frame):
+        """Hand over a frame with the raw camera image in frame['img_cam']"""
+        self.use(frame)
+        self.ring.append(frame)
+        if self.video_file:
+            self.use(frame)
+            self.video_queue.put(frame)
+        while len(self.ring) > self.ring_size:
+            self.done(self.ring.popleft())
+
+    def snapshot(self):
+        """Save the newest frame as a JPEG in the directory, named after the time it was taken"""
+        if self.ring:
+            frame = self.ring[-1]
+            self.use(frame)
+            self.snapshot_queue.put(frame)
+
+    def run(self):
+        while self.running or self.snapshot_queue.depth or self.video_queue.depth:
+            frame = self.snapshot_queue.get(timeout=0)
+            if frame is not None:
+                self.write(self.write_snapshot, frame)
+            frame = self.video_queue.get(timeout=self.poll_time)
+            if frame is not None:
+                self.write(self.write_video, frame)
+
+    def write(self, function, frame):
+        try:
+            function(frame)
+        except Exception:
+            logging.exception("Could not save frame")
+        finally:
+            self.done(frame)
+
+    def write_snapshot(self, frame):
+        file_name = os.path.join(self.directory, "{0}.jpg".format(int(frame['time'])))
+        cv2.imwrite(file_name, frame['img_cam'])
+        self.snapshots += 1
+        logging.info("Saved {0}".format(file_name))
+
+    def write_video(self, frame):
+        img = frame['img_cam']
+        if self.video is None:
+            height, width = img.shape[:2]
+            self.video = cv2.VideoWriter(self.video_file, cv2.VideoWriter_fourcc(*'MJPG'), self.frame_rate,
+                                         (width, height))
+        self.video.write(img)
+        self.recorded += 1
+
+    def report(self):
+        return "{0} snapshots, {1} frames recorded, {2} skipped".format(self.snapshots, self.recorded,
+                                                                         self.video_queue.dropped)
+
+    def stop(self):
+        """Finish writing what is queued and close the video"""
+        self.running = False
+        self.join()
+        if self.video is not None:
+            self.video.release()
+        while self.ring:
+            self.done(self.ring.popleft())
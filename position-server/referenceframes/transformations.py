@@ -3,6 +3,7 @@
 # -----------------------------------------------------------------------------
 
 from numpy import ndarray, array, append, zeros, ones, eye
+from math import cos, sin, atan2
 from numpy.linalg import det
 
 ROW, COL = 0, 1
@@ -137,3 +138,153 @@ class Transformation:
         """Create composite transformation from two transformations (left@self)"""   
         return Transformation(matrix=left.matrix@self.matrix)
 
+
+
+class SimilarityTransformation:
+    """Fast drop-in replacement for Transformation, for rotations, reflections, translations and uniform scaling
+
+    The transformation is stored as its parts: scaling, rotation angle (as cosine and sine),
+    a reflection flag, and translation. Composition and inversion use plain float arithmetic,
+    and the matrices are only made when asked for.
+    As with Transformation, points are transformed as p' = scaling*(rotation@p + translation).
+    """
+
+    __slots__ = ('scaling', 'cos', 'sin', 'mirror', 'tx', 'ty', '_matrix', '_inverse_matrix')
+
+    # 2D vectors
+    dimension = 2
+
+    def __init__(self, rotation=None, translation=None, scaling=1, matrix=None):
+        """Store translation and rotation, given the same arguments as Transformation"""
+        self._matrix = None
+        self._inverse_matrix = None
+        if matrix is None:
+            self.scaling = scaling
+            if rotation is None:
+                self.cos, self.sin, self.mirror = 1.0, 0.0, 1
+            else:
+                # First column is the rotated x-axis. The y-axis is flipped if the determinant is negative
+                self.cos, self.sin = float(rotation[0][0]), float(rotation[1][0])
+                det = rotation[0][0]*rotation[1][1] - rotation[0][1]*rotation[1][0]
+                self.mirror = 1 if det > 0 else -1
+            if translation is None:
+                self.tx, self.ty = 0.0, 0.0
+            else:
+                self.tx, self.ty = float(translation[0]), float(translation[1])
+        else:
+            # Obtain the scaling factor from the 2x2 determinant, and divide it out
+            det = matrix[0][0]*matrix[1][1] - matrix[0][1]*matrix[1][0]
+            scaling = abs(det)**0.5
+            self.scaling = scaling
+            self.cos, self.sin = matrix[0][0]/scaling, matrix[1][0]/scaling
+            self.mirror = 1 if det > 0 else -1
+            self.tx, self.ty = matrix[0][2]/scaling, matrix[1][2]/scaling
+
+    @classmethod
+    def from_angle(cls, angle, translation=(0, 0), scaling=1, mirror=False):
+        """Make a transformation from a rotation angle (rad) instead of a rotation matrix"""
+        transformation = cls.__new__(cls)
+        transformation._matrix = None
+        transformation._inverse_matrix = None
+        transformation.scaling = scaling
+        transformation.cos, transformation.sin = cos(angle), sin(angle)
+        transformation.mirror = -1 if mirror else 1
+        transformation.tx, transformation.ty = float(translation[0]), float(translation[1])
+        return transformation
+
+    @classmethod
+    def _from_parts(cls, scaling, cos_angle, sin_angle, mirror, tx, ty):
+        transformation = cls.__new__(cls)
+        transformation._matrix = None
+        transformation._inverse_matrix = None
+        transformation.scaling = scaling
+        transformation.cos, transformation.sin = cos_angle, sin_angle
+        transformation.mirror = mirror
+        transformation.tx, transformation.ty = tx, ty
+        return transformation
+
+    @property
+    def angle(self):
+        return atan2(self.sin, self.cos)
+
+    @property
+    def rotation(self):
+        return array([[self.cos, -self.sin*self.mirror],
+                      [self.sin, self.cos*self.mirror]])
+
+    @property
+    def translation(self):
+        return array([self.tx, self.ty])
+
+    @property
+    def matrix(self):
+        """Homogeneous transformation matrix, made once when first needed"""
+        if self._matrix is None:
+            s, c, n, m = self.scaling, self.cos, self.sin, self.mirror
+            self._matrix = array([[s*c, -s*n*m, s*self.tx],
+                                  [s*n, s*c*m, s*self.ty],
+                                  [0.0, 0.0, 1.0]])
+        return self._matrix
+
+    @property
+    def inverse_matrix(self):
+        """Inverse transformation matrix, made once when first needed"""
+        if self._inverse_matrix is None:
+            self._inverse_matrix = self.inverse().matrix
+        return self._inverse_matrix
+
+    def inverse(self):
+        """Return a new transformation object, whose matrix is the inverse of this one"""
+        c, n, m = self.cos, self.sin, self.mirror
+        # Rotation^T@translation, scaled so that the new scaling factor doesn't apply to it
+        tx = -(c*self.tx + n*self.ty)*self.scaling
+        ty = -m*(-n*self.tx + c*self.ty)*self.scaling
+        return SimilarityTransformation._from_parts(1/self.scaling, c, -m*n, m, tx, ty)
+
+    def __mul__(self, points):
+        """Transform points to different frame: output_points = H@input_points
+
+        Output has same dimension as input, as with Transformation.
+        """
+        s, c, n, m = self.scaling, self.cos, self.sin, self.mirror
+
+        # Cast input to array in case a plain list of tuple is used as argument
+        if not isinstance(points, ndarray):
+            points = array(points, dtype=float)
+        input_shape = points.shape
+
+        # A plain 2D point is transformed without further numpy overhead
+        if input_shape == (2,):
+            x, y = points
+            return array([s*(c*x - n*m*y + self.tx), s*(n*x + c*m*y + self.ty)])
+
+        if 1 in input_shape:
+            # A single point, as a row or column vector
+            points = points.reshape((self.dimension, 1))
+        else:
+            assert input_shape[ROW] == self.dimension, "Dimension error"
+
+        # Multiple horizontally concatenated column vectors: one matrix product, no appended row of ones
+        matrix = self.matrix
+        transformed_points = matrix[0:2, 0:2]@points + matrix[0:2, 2:3]
+
+        # Return the result in the same shape as the input argument
+        return transformed_points.reshape(input_shape)
+
+    def __matmul__(self, right):
+        """Create composite transformation from two transformations (self@right)"""
+        if not isinstance(right, SimilarityTransformation):
+            return Transformation(matrix=self.matrix@right.matrix)
+        c1, n1, m1 = self.cos, self.sin, self.mirror
+        c2, n2 = right.cos, right.sin
+        # Rotation by angle1 + mirror1*angle2, translation is rotation1@translation2 + translation1/scaling2
+        return SimilarityTransformation._from_parts(self.scaling*right.scaling,
+                                                    c1*c2 - n1*m1*n2,
+                                                    n1*c2 + c1*m1*n2,
+                                                    m1*right.mirror,
+                                                    c1*right.tx - n1*m1*right.ty + self.tx/right.scaling,
+                                                    n1*right.tx + c1*m1*right.ty + self.ty/right.scaling)
+
+    def __rmatmul__(self, left):
+        """Create composite transformation from two transformations (left@self)"""
+        return Transformation(matrix=left.matrix@self.matrix)
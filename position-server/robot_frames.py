@@ -1,18 +1,18 @@
 """Several constant or frequently used composite transformations"""
 
-from referenceframes.transformations import Transformation, ROW, COL
-from numpy import array, identity, append
+from referenceframes.transformations import SimilarityTransformation, ROW, COL
+from numpy import array, identity, append, zeros, einsum
 from numpy.linalg import norm
 
 def transform_to_gripper_from_bot(server_settings):
-    return Transformation(translation=-1*array(server_settings['p_bot_gripper']))
+    return SimilarityTransformation(translation=-1*array(server_settings['p_bot_gripper']))
 
 def transform_to_world_from_pixels(server_settings, field_corners, cm_per_px):
     """Transform camera pixels into centimeters relative to camera midpoint"""
     # Transform to make positive y-axis point upwards
     rotation = array([[1, 0],[0, -1]]) # Flip y-axis
     translation = array([0, 0]) # No translation
-    H_to_flipped_from_camera = Transformation(rotation, translation)
+    H_to_flipped_from_camera = SimilarityTransformation(rotation, translation)
 
     # Obtain previously computed field corners
     A, B, C, D = field_corners
@@ -25,13 +25,13 @@ def transform_to_world_from_pixels(server_settings, field_corners, cm_per_px):
     # Transform to align axes with center of picture
     rotation = identity(2) # No rotation
     translation = array([-image_width/2, image_height/2])
-    H_to_centered_from_flipped = Transformation(rotation, translation)
+    H_to_centered_from_flipped = SimilarityTransformation(rotation, translation)
 
     # Scale to centimeters
     rotation = identity(2) # No rotation
     translation = array([0,0]) # No translation 
     scaling = cm_per_px
-    H_to_world_from_centered = Transformation(rotation, translation, scaling)
+    H_to_world_from_centered = SimilarityTransformation(rotation, translation, scaling)
 
     # Return the composite transformation
     return H_to_world_from_centered@H_to_centered_from_flipped@H_to_flipped_from_camera
@@ -49,7 +49,7 @@ def transform_to_world_from_bot(server_settings, p_world_midbase_marker, p_world
     """Convert marker locations into transformation matrices"""
 
     # Constant transformation between label and robot
-    H_to_bot_from_label = Transformation(identity(2), array(server_settings['p_bot_midbase']))
+    H_to_bot_from_label = SimilarityTransformation(identity(2), array(server_settings['p_bot_midbase']))
     H_to_label_from_bot = H_to_bot_from_label.inverse()
 
     # x frame axes of the label, expressed in the world: A line through the two markers
@@ -64,7 +64,73 @@ def transform_to_world_from_bot(server_settings, p_world_midbase_marker, p_world
     # Transformation between world and label
     rotation = append(label_xaxis_world, label_yaxis_world, axis=COL)
     translation = p_world_midbase_marker
-    H_to_world_from_label = Transformation(rotation, translation)    
+    H_to_world_from_label = SimilarityTransformation(rotation, translation)    
 
     # Return the composite transformation
     return H_to_world_from_label@H_to_label_from_bot
+
+
+def stack_to_world_from_bot(server_settings, p_world_midbase_markers, p_world_apex_markers):
+    """Convert marker locations of N robots into a (N,3,3) stack of transformation matrices
+
+    Same as transform_to_world_from_bot, but for all robots at once.
+    The marker locations are given as (N,2) arrays, one row per robot.
+    """
+    # x frame axes of the labels, expressed in the world: A line through the two markers
+    label_xaxis_world = p_world_apex_markers-p_world_midbase_markers
+    label_xaxis_world = label_xaxis_world/norm(label_xaxis_world, axis=1).reshape((-1, 1))
+
+    # 90 degree rotation to obtain corresponding y-axes
+    label_yaxis_world = label_xaxis_world@array([[0, -1], [1, 0]]).T
+
+    # Rotation of the robots is that of the labels, and their origin is offset from the midbase marker
+    H_to_world_from_bot = zeros((len(p_world_midbase_markers), 3, 3))
+    H_to_world_from_bot[:, 0:2, 0] = label_xaxis_world
+    H_to_world_from_bot[:, 0:2, 1] = label_yaxis_world
+    H_to_world_from_bot[:, 0:2, 2] = p_world_midbase_markers - \
+        einsum('nij,j->ni', H_to_world_from_bot[:, 0:2, 0:2], array(server_settings['p_bot_midbase']))
+    H_to_world_from_bot[:, 2, 2] = 1
+    return H_to_world_from_bot
+
+
+def stack_inverse(H_stack):
+    """Inverse of a (N,3,3) stack of unscaled transformation matrices"""
+    rotation_transposed = H_stack[:, 0:2, 0:2].transpose((0, 2, 1))
+    H_inverse = zeros(H_stack.shape)
+    H_inverse[:, 0:2, 0:2] = rotation_transposed
+    H_inverse[:, 0:2, 2] = -einsum('nij,nj->ni', rotation_transposed, H_stack[:, 0:2, 2])
+    H_inverse[:, 2, 2] = 1
+    return H_inverse
+
+
+class FieldCalibration:
+    """Transformations that only depend on the playing field and the server settings
+
+    Make this once when the playing field is accepted, and again when the settings are reloaded,
+    and pass it to the per-frame computations.
+    """
+
+    def __init__(self, server_settings, field_corners):
+        # Field corners, in pixels
+        self.field_corners = field_corners
+
+        # Transformations from pixels to the world frame, at the height of markers, balls and bounding boxes
+        self.H_to_world_from_marker_pixels = transform_to_world_from_marker_pixels(server_settings, field_corners)
+        self.H_to_world_from_ball_pixels = transform_to_world_from_ball_pixels(server_settings, field_corners)
+        self.H_to_world_from_bounding_pixels = transform_to_world_from_bounding_pixels(server_settings, field_corners)
+        self.H_to_bounding_pixels_from_world = self.H_to_world_from_bounding_pixels.inverse()
+
+        # Transformation from base frame to frame at gripper
+        self.H_to_gripper_from_bot = transform_to_gripper_from_bot(server_settings)
+
+        # Corner locations, in world
+        self.corners_world = self.H_to_world_from_marker_pixels*array(field_corners).T
+
+        # Matrix of depot locations, in world
+        self.depots_world = array(server_settings['depots_world']).T
+
+        # Matrix of bounding box locations, in the robot frame
+        self.bounding_box_in_robot = array(server_settings['bounding_box_cm']).T
+
+        # Images that only depend on the playing field, made by the detection when first needed
+        self.masks = {}
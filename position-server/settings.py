@@ -115,7 +115,14 @@ robot_settings = {
 # Server settings
 server_settings = {
     'SERVER_BASE_PORT' : 50000,
+    'BROADCAST_KEEPALIVE' : 0.06, # s. Resend the last data if no new frame was analysed in this time
+    'SETTINGS_RESEND_INTERVAL' : 1, # s. Robot settings are sent when they change, and at least this often
+    'BROADCAST_MODE' : 'robot',  # 'robot': a frame for each robot on its own port. 'world': one frame for all robots
+    'WORLD_ADDRESS' : '239.255.0.1', # Multicast group for world frames
+    'WORLD_PORT' : 50100,
     'THRESHOLD' : 145,         # Threshold for b/w version of camera image. Higher number means more black
+    'THRESHOLD_TYPE' : 'simple', # 'simple', 'otsu', 'adaptive' or 'canny'
+    'THRESHOLD_CURVE' : 1.4,   # Brighten the greyscale image this much before a 'simple' threshold
     'WIDTH' : 1920,            # Camera image
     'HEIGHT' : 1080,
     'extra border outside' : -70,
@@ -138,6 +145,29 @@ server_settings = {
     'ball_info_max_size': 3, # Number of nearest balls each robot should get details of
     'depot_radius': 200, #pixels
     'reload_settings_after_n_loops': 200,
+    'DETECT_UNWARPED': False, # Find markers and balls in the camera image, and only warp their locations to the playing field
+    'WARP_GREY': False, # Warp only the greyscale camera image to the playing field. Faster, but the preview is grey.
+    'PIPELINE_QUEUE_SIZE': 1, # Frames waiting between pipeline stages. Older frames are dropped.
+    'RECORD_VIDEO': '', # File to record all camera frames to, like 'recording.avi', to replay with benchmark.py
+    'FIELD_DETECTION': 'ask', # 'ask' to confirm the playing field in a window. 'edges', '4_blobs' or 'none' to take it without asking.
+    'PREVIEW': 'window', # 'window', 'mjpeg' to watch it on http://PREVIEW_ADDRESS:PREVIEW_PORT/, or 'none' to run headless
+    'PREVIEW_FPS': 10, # Most previews drawn per second
+    'PREVIEW_ADDRESS': '127.0.0.1',
+    'PREVIEW_PORT': 8000,
+    'CONTROL_ADDRESS': '127.0.0.1', # Commands, the same as the keys of the window, over UDP. See control.py.
+    'CONTROL_PORT': 50200, # 0 to only take commands from the window
+    'LOOP_DELAY': 0, # seconds. Slows down the main loop while debugging.
+    'FULL_SCAN_INTERVAL': 15, # Frames between searches of the whole image for markers. 1 searches the whole image every frame.
+    'MARKER_SEARCH_MARGIN': 40, # pixels. Search this far around the predicted marker location
+    'CODE_DOT_SAMPLE_RADIUS': 1, # pixels. Read each code dot as the majority of the pixels this close to it. 0 reads one pixel.
+    'ID_VOTE_FRAMES': 5, # Robot ids are voted on over this many frames, so one misread code does not change it. 1 to not vote.
+    'POSE_FILTER_GAIN': 0.5, # Part of each new measurement taken into the smoothed robot poses. 1 sends them as they are.
+    'MAX_COAST_TIME': 0.3, # seconds. Robots that are not seen are predicted ahead for this long, then dropped.
+    'BALL_MEMORY_TIME': 1.0, # seconds. Balls hidden under a robot are remembered for this long.
+    'BALL_TARGET_SWITCH': 0.8, # Each robot gets a ball of its own. It keeps it, unless another is nearer than this times the distance to it.
+    'GEOMETRY_MOVE_THRESHOLD': 0.5, # cm. The data for a robot is only computed again when it or the balls moved more than this.
+    'MARKER_DETECTION_SCALE': 1, # 1, 2 or 4. Find markers in an image this much smaller, then refine them at full size
+    'BALL_DETECTION_SCALE': 1, # Same for balls. See benchmark_detection.py for speed and accuracy.
     'bounding_box_cm': [
         # List of points in centimeters, encircling the robot
         # Starting at left wheel, then go counterclockwise
@@ -159,3 +189,4 @@ if 'Ubuntu' in platform.platform():
     print('Laurens Mode')
     server_settings['FILE'] = 'test_images/over_the_edge_error_nodump.jpg'
     server_settings['SERVER_BASE_PORT'] = 60000
+    server_settings['LOOP_DELAY'] = 2
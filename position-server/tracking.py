@@ -0,0 +1,340 @@
+"""Track robot markers between frames, so we only have to look for them near where they were,
+keep their ids steady and smooth their poses. Track balls, to give them steady ids."""
+
+from collections import deque
+from math import atan2, cos, sin, pi
+
+import numpy as np
+
+from antoncv import merge_regions, find_triangles_in_regions, find_triangles_pyramid
+
+
+class MarkerTracker:
+    """Search for robot markers only around the location predicted from the previous frames
+
+    The whole image is scanned every full_scan_interval frames, to find robots that just came in,
+    and right after a known robot was not found near its predicted location.
+    """
+
+    def __init__(self, full_scan_interval=15, search_margin=40, scale=1):
+        # Frames between full scans. 1 scans the whole image every frame.
+        self.full_scan_interval = full_scan_interval
+
+        # Full scans look for markers in an image downscaled by this factor first
+        self.scale = scale
+
+        # Pixels around the predicted marker, for the distance a robot can move unexpectedly between frames
+        self.search_margin = search_margin
+
+        # Last two sightings of each robot: {robot_id: [(time, midbase, apex), ...]}
+        self.tracks = {}
+        self.frames_since_full_scan = 0
+        self.last_scan_was_full = False
+        self.robot_lost = False
+
+        # Statistics
+        self.full_scans = 0
+        self.region_scans = 0
+
+    def predict(self, robot_id, t):
+        """Midbase and apex of a robot marker at time t, assuming it keeps moving at the same speed"""
+        sightings = self.tracks[robot_id]
+        t1, midbase, apex = sightings[-1]
+        if len(sightings) < 2:
+            return midbase, apex
+        t0, previous_midbase, previous_apex = sightings[0]
+        if t1 <= t0:
+            return midbase, apex
+        factor = (t - t1) / (t1 - t0)
+        return midbase + factor * (midbase - previous_midbase), apex + factor * (apex - previous_apex)
+
+    def search_regions(self, image_shape, t):
+        """Rectangles (x0, y0, x1, y1) around the predicted location of each known marker"""
+        height, width = image_shape[:2]
+        regions = []
+        for robot_id in self.tracks:
+            midbase, apex = self.predict(robot_id, t)
+            center = (midbase + apex) / 2
+
+            # The whole triangle is within its height of the center
+            radius = np.linalg.norm(apex - midbase) + self.search_margin
+            x0, y0 = map(int, np.maximum(center - radius, 0))
+            x1, y1 = map(int, np.minimum(center + radius, (width, height)))
+            if x1 > x0 and y1 > y0:
+                regions.append((x0, y0, x1, y1))
+        return merge_regions(regions)
+
+    def full_scan_due(self):
+        return not self.tracks or self.robot_lost or self.frames_since_full_scan + 1 >= self.full_scan_interval
+
+    def find_triangles(self, img_grey, t):
+        """Find marker triangles in the black and white image, like find_triangles_in_binary"""
+        if self.full_scan_due():
+            self.frames_since_full_scan = 0
+            self.last_scan_was_full = True
+            self.full_scans += 1
+            return find_triangles_pyramid(img_grey, self.scale)
+
+        self.frames_since_full_scan += 1
+        self.last_scan_was_full = False
+        self.region_scans += 1
+        return img_grey, find_triangles_in_regions(img_grey, self.search_regions(img_grey.shape, t))
+
+    def update(self, robot_markers, t, field_warp=None):
+        """Remember where the robots were found, as returned by find_robot_markers
+
+        If a field_warp is given, the markers were found in the camera image and returned in the warped image.
+        They are then remembered in the camera image, where they are looked for.
+        """
+        if field_warp is not None and robot_markers:
+            robot_ids = list(robot_markers)
+            points = field_warp.to_camera(np.array([robot_markers[robot_id] for robot_id in robot_ids],
+                                                   dtype=float).reshape((-1, 2)))
+            robot_markers = dict(zip(robot_ids, points.reshape((-1, 2, 2))))
+
+        for robot_id, (midbase, apex) in robot_markers.items():
+            if robot_id < 0:
+                # Code could not be read
+                continue
+            sighting = (t, np.array(midbase, dtype=float), np.array(apex, dtype=float))
+            self.tracks[robot_id] = self.tracks.get(robot_id, [])[-1:] + [sighting]
+
+        missing = [robot_id for robot_id in self.tracks if robot_id not in robot_markers]
+        if self.last_scan_was_full:
+            # Not in the whole image: the robot has left the field
+            for robot_id in missing:
+                del self.tracks[robot_id]
+            self.robot_lost = False
+        else:
+            # Not where we expected it: look everywhere next frame
+            self.robot_lost = bool(missing)
+
+
+class IdVoting:
+    """Keeps the robot id of each marker steady, so one misread code does not change it
+
+    Markers are matched to the markers of the previous frames, nearest pairs first. Each keeps the ids it was decoded as
+    in the last history frames, with their confidence. Its id is the one with the most confidence in total,
+    so it only changes when the code is read differently a few frames in a row.
+    """
+
+    def __init__(self, history=5, max_distance=40):
+        # Frames to vote over. 1 takes the decoded id of each frame as it is.
+        self.history = history
+
+        # Pixels a marker can move between frames
+        self.max_distance = max_distance
+
+        # [{'midbase': array, 'votes': deque of (robot_id, confidence), 'missed': frames not seen}, ...]
+        self.markers = []
+
+    def vote(self, robot_ids, confidences, midbases):
+        """The voted id of each marker and the confidence it got, from the ids and confidences decoded this frame"""
+        midbases = np.asarray(midbases, dtype=float).reshape((-1, 2))
+
+        # Nearest pairs of a known and a found marker first, so close robots don't take each other's votes
+        known_of_found = np.full(len(midbases), -1)
+        if len(midbases) and self.markers:
+            known = np.array([marker['midbase'] for marker in self.markers])
+            distances = np.linalg.norm(known[:, np.newaxis, :] - midbases[np.newaxis, :, :], axis=2)
+            known_markers, found = np.nonzero(distances < self.max_distance)
+            order = distances[known_markers, found].argsort()
+            taken = set()
+            for known_marker, i in zip(known_markers[order].tolist(), found[order].tolist()):
+                if known_marker not in taken and known_of_found[i] < 0:
+                    known_of_found[i] = known_marker
+                    taken.add(known_marker)
+
+        matched = []
+        for midbase, known_marker in zip(midbases, known_of_found.tolist()):
+            if known_marker >= 0:
+                marker = self.markers[known_marker]
+            else:
+                marker = {'votes': deque(maxlen=self.history)}
+            marker['midbase'] = midbase
+            marker['missed'] = 0
+            matched.append(marker)
+        unmatched = [marker for i, marker in enumerate(self.markers) if i not in known_of_found]
+
+        # Markers out of sight are forgotten after a while
+        for marker in unmatched:
+            marker['missed'] += 1
+        self.markers = matched + [marker for marker in unmatched if marker['missed'] < self.history]
+
+        voted_ids = np.full(len(matched), -1)
+        scores = np.zeros(len(matched))
+        for i, (marker, robot_id, confidence) in enumerate(zip(matched, robot_ids, confidences)):
+            if marker['votes'].maxlen != self.history:
+                # The setting was changed
+                marker['votes'] = deque(marker['votes'], maxlen=self.history)
+            marker['votes'].append((int(robot_id), float(confidence)))
+
+            totals = {}
+            for vote_id, vote_confidence in marker['votes']:
+                if vote_id >= 0:
+                    totals[vote_id] = totals.get(vote_id, 0) + vote_confidence
+            if totals:
+                voted_ids[i] = max(totals, key=totals.get)
+                scores[i] = totals[voted_ids[i]] / len(marker['votes'])
+        return voted_ids, scores
+
+
+class PoseFilter:
+    """Smooths the marker of each robot, and estimates how fast it moves and turns
+
+    This is a constant velocity (alpha-beta) filter on the midbase location and the heading of each marker.
+    The gain is the part of the difference between measured and predicted pose that is taken over:
+    1 takes the measurements as they are. Robots that are not seen are predicted ahead for max_coast seconds.
+    Everything is in pixels and seconds, with the heading as the angle of the marker in the image.
+    """
+
+    def __init__(self, gain=0.5, max_coast=0.3):
+        self.gain = gain
+        self.max_coast = max_coast
+
+        # {robot_id: {'time', 'seen', 'midbase', 'velocity', 'heading', 'angular_velocity', 'length'}}
+        self.robots = {}
+
+    def update(self, robot_markers, t):
+        """Filtered markers of all robots at time t, from those found in the frame taken at time t
+
+        Returns the markers like find_robot_markers, and the motion of each robot:
+        {robot_id: [x velocity, y velocity, angular velocity, seconds since it was last seen]}
+        Markers with an unknown id (-1) are passed on as they are.
+        """
+        # Critically damped
+        alpha = self.gain
+        beta = alpha ** 2 / (2 - alpha)
+
+        for robot_id, (midbase, apex) in robot_markers.items():
+            if robot_id < 0:
+                continue
+            midbase = np.array(midbase, dtype=float)
+            direction = np.array(apex, dtype=float) - midbase
+            heading = atan2(direction[1], direction[0])
+            length = np.linalg.norm(direction)
+
+            robot = self.robots.get(robot_id)
+            if robot is None or t - robot['seen'] > self.max_coast:
+                # New, or lost for too long to predict
+                self.robots[robot_id] = {'time': t, 'seen': t, 'midbase': midbase, 'velocity': np.zeros(2),
+                                         'heading': heading, 'angular_velocity': 0.0, 'length': length}
+                continue
+
+            dt = t - robot['time']
+            predicted_midbase, predicted_heading = self.predict(robot, t)
+            residual = midbase - predicted_midbase
+            heading_residual = (heading - predicted_heading + pi) % (2 * pi) - pi
+            robot['midbase'] = predicted_midbase + alpha * residual
+            robot['heading'] = predicted_heading + alpha * heading_residual
+            if dt > 0:
+                robot['velocity'] = robot['velocity'] + beta * residual / dt
+                robot['angular_velocity'] += beta * heading_residual / dt
+            robot['length'] += alpha * (length - robot['length'])
+            robot['time'] = robot['seen'] = t
+
+        markers = {robot_id: marker for robot_id, marker in robot_markers.items() if robot_id < 0}
+        motion = {robot_id: [0.0, 0.0, 0.0, 0.0] for robot_id in markers}
+        for robot_id, robot in list(self.robots.items()):
+            if t - robot['seen'] > self.max_coast:
+                del self.robots[robot_id]
+                continue
+            midbase, heading = self.predict(robot, t)
+            apex = midbase + robot['length'] * np.array([cos(heading), sin(heading)])
+            markers[robot_id] = [tuple(midbase), tuple(apex)]
+            motion[robot_id] = [robot['velocity'][0], robot['velocity'][1], robot['angular_velocity'], t - robot['seen']]
+        return markers, motion
+
+    @staticmethod
+    def predict(robot, t):
+        """Midbase and heading of a robot at time t, if it keeps moving at the same speed"""
+        dt = t - robot['time']
+        return robot['midbase'] + robot['velocity'] * dt, robot['heading'] + robot['angular_velocity'] * dt
+
+
+class BallTracker:
+    """Gives each ball a steady id, and remembers balls that are hidden under a robot for a while
+
+    Balls are matched to the nearest ball of the previous frame within max_distance pixels, nearest pairs first.
+    A ball that is not found stays where it was last seen: for memory seconds if it is under a robot,
+    which blacks it out, and for max_missed frames otherwise, so a ball that is hard to see does not flicker.
+    The ball each robot goes for is kept in targets, see get_ball_info.
+    """
+
+    def __init__(self, max_distance=24, memory=1.0, max_missed=2):
+        self.max_distance = max_distance
+        self.memory = memory
+        self.max_missed = max_missed
+
+        # Tracked balls: pixel locations (M, 2), ids, time last seen and frames missed since
+        self.locations = np.zeros((0, 2))
+        self.ids = np.zeros(0, dtype=int)
+        self.seen = np.zeros(0)
+        self.missed = np.zeros(0, dtype=int)
+        self.next_id = 0
+
+        # Ball each robot goes for: {robot_id: ball_id}
+        self.targets = {}
+
+        # Statistics
+        self.new_balls = 0
+        self.remembered = 0
+
+    def update(self, balls, t, robot_boxes=()):
+        """All balls at time t, from those found in the frame taken then and the robot bounding boxes in it
+
+        Returns an (M, 2) array of ball locations, those found first, and an (M,) array of their ids.
+        """
+        balls = np.asarray(balls, dtype=float).reshape((-1, 2))
+
+        # Nearest pairs of a tracked and a found ball first
+        track_of_ball = np.full(len(balls), -1)
+        if len(balls) and len(self.ids):
+            distances = np.linalg.norm(self.locations[:, np.newaxis, :] - balls[np.newaxis, :, :], axis=2)
+            tracks, found = np.nonzero(distances < self.max_distance)
+            order = distances[tracks, found].argsort()
+            matched_tracks = set()
+            for track, ball in zip(tracks[order].tolist(), found[order].tolist()):
+                if track not in matched_tracks and track_of_ball[ball] < 0:
+                    track_of_ball[ball] = track
+                    matched_tracks.add(track)
+
+        matched = track_of_ball >= 0
+        ids = np.empty(len(balls), dtype=int)
+        ids[matched] = self.ids[track_of_ball[matched]]
+        ids[~matched] = np.arange(self.next_id, self.next_id + np.count_nonzero(~matched))
+        self.next_id += np.count_nonzero(~matched)
+        self.new_balls += np.count_nonzero(~matched)
+
+        # Balls that were not found are kept for a while, longer when a robot is on top of them
+        lost = np.ones(len(self.ids), dtype=bool)
+        lost[track_of_ball[matched]] = False
+        missed = self.missed[lost] + 1
+        hidden = inside_convex_polygons(self.locations[lost], robot_boxes)
+        keep = np.where(hidden, t - self.seen[lost] <= self.memory, missed <= self.max_missed)
+        self.remembered = np.count_nonzero(keep)
+
+        self.locations = np.concatenate([balls, self.locations[lost][keep]])
+        self.ids = np.concatenate([ids, self.ids[lost][keep]])
+        self.seen = np.concatenate([np.full(len(balls), t), self.seen[lost][keep]])
+        self.missed = np.concatenate([np.zeros(len(balls), dtype=int), missed[keep]])
+        return self.locations, self.ids
+
+    def report(self):
+        return "{0} tracked, {1} remembered, {2} ids given out".format(len(self.ids), self.remembered, self.new_balls)
+
+
+def inside_convex_polygons(points, polygons):
+    """For each point (M, 2), True if it is inside any of the convex polygons (N, corners, 2)"""
+    points = np.asarray(points, dtype=float).reshape((-1, 2))
+    polygons = np.asarray(polygons, dtype=float)
+    if not len(points) or not len(polygons):
+        return np.zeros(len(points), dtype=bool)
+
+    # Which side of each edge the points are on: (N, corners, M). Inside, they are on the same side of all edges.
+    corners = polygons[:, :, np.newaxis, :]
+    edges = np.roll(polygons, -1, axis=1)[:, :, np.newaxis, :] - corners
+    to_points = points[np.newaxis, np.newaxis, :, :] - corners
+    sides = edges[..., 0] * to_points[..., 1] - edges[..., 1] * to_points[..., 0]
+    inside = (sides >= 0).all(axis=1) | (sides <= 0).all(axis=1)
+    return inside.any(axis=0)